@@ -19,3 +19,8 @@
 
 import c_import.header_parser
 import c_import.loader
+import c_import.description
+import c_import.cache
+import c_import.generator
+import c_import.importer
+import c_import.shared
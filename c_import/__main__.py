@@ -0,0 +1,83 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import argparse
+import sys
+
+import c_import.generator
+import c_import.header_parser
+import c_import.loader
+
+
+def generate(args: argparse.Namespace):
+    declaration_filter = None
+    if args.symbol is not None or args.prefix is not None:
+        declaration_filter = c_import.header_parser.DeclarationFilter(
+            names=frozenset(args.symbol) if args.symbol is not None else None,
+            prefixes=tuple(args.prefix or ()),
+        )
+
+    (interface, _) = c_import.loader.parse_headers(
+        args.headers,
+        args.cpp,
+        args.cpp_flags,
+        not args.no_cpp,
+        declaration_filter=declaration_filter,
+    )
+    source = c_import.generator.generate_module(
+        interface,
+        args.library,
+        comment=f'Headers: {" ".join(args.headers)}',
+    )
+
+    if args.output == '-':
+        sys.stdout.write(source)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(source)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m c_import')
+    commands = parser.add_subparsers(required=True)
+
+    generate_parser = commands.add_parser(
+        'generate',
+        help='Generate a python module with static bindings',
+    )
+    generate_parser.add_argument('library')
+    generate_parser.add_argument('headers', nargs='+')
+    generate_parser.add_argument('-o', '--output', default='-')
+    generate_parser.add_argument('--cpp', help='defaults to $CPP')
+    generate_parser.add_argument('--cpp-flags', help='defaults to $CPPFLAGS')
+    generate_parser.add_argument(
+        '--no-cpp',
+        action='store_true',
+        help='pre-process the headers with libclang',
+    )
+    generate_parser.add_argument('--symbol', action='append')
+    generate_parser.add_argument('--prefix', action='append')
+    generate_parser.set_defaults(command=generate)
+
+    args = parser.parse_args(argv)
+    args.command(args)
+
+
+if __name__ == '__main__':
+    main()
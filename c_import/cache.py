@@ -0,0 +1,169 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''On-disk cache of interface descriptions.
+
+Every entry is stored under a key derived from the load request (headers,
+cpp command, CPPFLAGS and libclang version). The entry records the
+digest of every file that was included while preprocessing, and is only
+used when all of them still match.
+
+Entries are written to a temporary file in the cache directory and moved
+into place with os.replace, so concurrent processes never see a partial
+entry.
+'''
+
+import hashlib
+import json
+import os
+import pathlib
+import re
+import tempfile
+import typing
+
+
+# Bump when the format of the entries changes
+FORMAT_VERSION = 3
+
+_LINEMARKER = re.compile(r'^# \d+ "((?:[^"\\]|\\.)*)"', re.MULTILINE)
+
+
+def file_digest(path: typing.Union[str, pathlib.Path]) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def digest_files(paths: typing.Iterable[str]) -> typing.Dict[str, str]:
+    return {path: file_digest(path) for path in sorted(paths)}
+
+
+def files_unchanged(digests: typing.Dict[str, str]) -> bool:
+    '''Check that the files still have the digests in digests'''
+    try:
+        return all(
+            file_digest(path) == digest
+            for (path, digest) in digests.items()
+        )
+    except OSError:
+        return False
+
+
+def request_key(**request) -> str:
+    '''Hash the json representation of the keyword arguments'''
+    request['format_version'] = FORMAT_VERSION
+    encoded = json.dumps(request, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def included_files(preprocessed: str) -> typing.Set[str]:
+    '''Files included by the main file, according to cpp's linemarkers'''
+    paths = _LINEMARKER.findall(preprocessed)
+    main_file = paths[0] if paths else None
+    return {
+        re.sub(r'\\(.)', r'\1', path)
+        for path in paths
+        if not path.startswith('<') and path != main_file
+    }
+
+
+_LINEMARKER_FLAGS = re.compile(
+    r'^# \d+ "((?:[^"\\]|\\.)*)"((?: \d+)*)$',
+    re.MULTILINE,
+)
+
+
+def directly_included_files(preprocessed: str) -> typing.Set[str]:
+    '''Files included by the main file itself, according to cpp's linemarkers
+
+    A linemarker with flag 1 enters an included file, one with flag 2
+    returns to the file that included it.
+    '''
+    included = set()
+    stack: typing.List[str] = []
+    main_file = None
+    for (path, flags) in _LINEMARKER_FLAGS.findall(preprocessed):
+        path = re.sub(r'\\(.)', r'\1', path)
+        flags = flags.split()
+        if main_file is None:
+            main_file = path
+            stack.append(path)
+        elif '1' in flags:
+            if stack[-1] == main_file and not path.startswith('<'):
+                included.add(path)
+            stack.append(path)
+        elif '2' in flags:
+            while len(stack) > 1 and stack[-1] != path:
+                stack.pop()
+            stack[-1] = path
+        else:
+            stack[-1] = path
+    return included
+
+
+def atomic_write(path: pathlib.Path, data: bytes):
+    with tempfile.NamedTemporaryFile(
+            dir=path.parent,
+            prefix=f'.{path.name}.',
+            delete=False,
+    ) as temp:
+        try:
+            temp.write(data)
+            temp.flush()
+            os.fsync(temp.fileno())
+        except BaseException:
+            os.unlink(temp.name)
+            raise
+    os.replace(temp.name, path)
+
+
+class InterfaceCache:
+    def __init__(self, directory: typing.Union[str, pathlib.Path]):
+        self.directory = pathlib.Path(directory)
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.directory / f'{key}.json'
+
+    def load(self, key: str) -> typing.Optional[dict]:
+        '''Get the description stored under key, None if missing or stale'''
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not files_unchanged(entry['dependencies']):
+            return None
+
+        return entry['description']
+
+    def store(
+            self,
+            key: str,
+            dependencies: typing.Iterable[str],
+            description: dict
+    ):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = {
+            'dependencies': digest_files(dependencies),
+            'description': description,
+        }
+        atomic_write(
+            self._entry_path(key),
+            json.dumps(entry, separators=(',', ':')).encode('utf-8'),
+        )
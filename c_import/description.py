@@ -0,0 +1,637 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Clang-free description of a CInterface.
+
+A description only contains lists, dicts, strings, integers and None,
+so it can be stored as JSON and turned back into ctypes classes
+without libclang.
+
+Type references inside a description are encoded as:
+  None                              -> void
+  'c_int'                           -> a ctypes fundamental type
+  ['pointer', ref]                  -> ctypes.POINTER(ref)
+  ['array', ref, length]            -> ref * length
+  ['function', flags, ref, [refs]]  -> function pointer prototype
+  ['record', index]                 -> description['records'][index]
+'''
+
+import collections.abc
+import copyreg
+import ctypes
+import functools
+import hashlib
+import json
+import sys
+import threading
+import typing
+import weakref
+
+from c_import.header_parser import CInterface, RECORD_CLASSES
+
+
+_RECORD_KINDS = {
+    'struct': ctypes.Structure,
+    'union': ctypes.Union,
+}
+
+
+class _Describer:
+    def __init__(self):
+        self.records: typing.List[dict] = []
+        self.record_indices: typing.Dict[type, int] = {}
+
+    def describe_record(self, ctype: type) -> int:
+        if ctype in self.record_indices:
+            return self.record_indices[ctype]
+
+        kind = 'struct' if issubclass(ctype, ctypes.Structure) else 'union'
+        record: typing.Dict[str, typing.Any] = {
+            'name': ctype.__name__,
+            'kind': kind,
+            'pack': ctype.__dict__.get('_pack_'),
+            'anonymous': ctype.__dict__.get('_anonymous_'),
+            'fields': None,
+        }
+
+        # Register before describing the fields, records may refer to
+        # themselves through pointers.
+        index = len(self.records)
+        self.records.append(record)
+        self.record_indices[ctype] = index
+
+        if '_fields_' in ctype.__dict__:
+            record['fields'] = [
+                [field[0], self.describe_type(field[1]), *field[2:]]
+                for field in ctype._fields_
+            ]
+        return index
+
+    def describe_type(self, ctype: typing.Optional[type]) -> typing.Any:
+        if ctype is None:
+            return None
+
+        if issubclass(ctype, ctypes._Pointer):
+            return ['pointer', self.describe_type(ctype._type_)]
+
+        if issubclass(ctype, ctypes.Array):
+            return ['array', self.describe_type(ctype._type_), ctype._length_]
+
+        if issubclass(ctype, ctypes._CFuncPtr):
+            return [
+                'function',
+                ctype._flags_,
+                self.describe_type(ctype._restype_),
+                [self.describe_type(x) for x in ctype._argtypes_],
+            ]
+
+        if issubclass(ctype, (ctypes.Structure, ctypes.Union)):
+            return ['record', self.describe_record(ctype)]
+
+        assert getattr(ctypes, ctype.__name__) is ctype, ctype
+        return ctype.__name__
+
+
+def describe_interface(interface: CInterface) -> dict:
+    '''Convert the ctypes classes of an interface into a description.'''
+    if isinstance(interface.types, DescribedTable) and \
+       isinstance(interface.symbols, DescribedTable) and \
+       interface.types._builder is interface.symbols._builder:
+        # Lazily built interfaces still have their description
+        return {
+            'types': interface.types._refs,
+            'symbols': interface.symbols._refs,
+            'enum_consts': dict(interface.enum_consts),
+            'variadic': sorted(interface.variadic),
+            'records': interface.types._builder.records,
+        }
+
+    describer = _Describer()
+    description = {
+        'types': {
+            name: describer.describe_type(ctype)
+            for (name, ctype) in interface.types.items()
+        },
+        'symbols': {
+            name: describer.describe_type(ctype)
+            for (name, ctype) in interface.symbols.items()
+        },
+        'enum_consts': dict(interface.enum_consts),
+        'variadic': sorted(interface.variadic),
+    }
+    description['records'] = describer.records
+    return description
+
+
+def _embedded_records(ref: typing.Any) -> typing.Iterator[int]:
+    '''Records that are stored by value inside a type'''
+    while isinstance(ref, list) and ref[0] == 'array':
+        ref = ref[1]
+    if isinstance(ref, list) and ref[0] == 'record':
+        yield ref[1]
+
+
+def record_completion_order(
+        records: typing.List[dict],
+        indices: typing.Optional[typing.Collection[int]] = None,
+) -> typing.List[int]:
+    '''Order to set the fields of records in.
+
+    ctypes requires the layout of a member to be final before it is
+    used as a field, so records stored by value come first. Only the
+    records in indices are ordered, the others are assumed complete.
+    '''
+    order: typing.List[int] = []
+    visited: typing.Set[int] = set()
+    selected = range(len(records)) if indices is None else indices
+
+    def visit(index: int):
+        if index in visited or index not in selected:
+            return
+        visited.add(index)
+        for field in records[index]['fields'] or ():
+            for embedded in _embedded_records(field[1]):
+                visit(embedded)
+        order.append(index)
+
+    for index in selected:
+        visit(index)
+    return order
+
+
+def _referenced_records(ref: typing.Any) -> typing.Iterator[int]:
+    '''Records a type refers to, by value or not'''
+    if not isinstance(ref, list):
+        return
+
+    kind = ref[0]
+    if kind == 'record':
+        yield ref[1]
+    elif kind in ('pointer', 'array'):
+        yield from _referenced_records(ref[1])
+    elif kind == 'function':
+        yield from _referenced_records(ref[2])
+        for argument in ref[3]:
+            yield from _referenced_records(argument)
+
+
+def record_fingerprint(records: typing.List[dict], index: int) -> str:
+    '''Digest of a record and of every record it refers to.
+
+    Records are numbered in the order they are reached from index, so
+    equal fingerprints mean interchangeable ctypes classes, including
+    through pointers.
+    '''
+    order = {index: 0}
+    reached = [index]
+    for current in reached:
+        for field in records[current]['fields'] or ():
+            for referenced in _referenced_records(field[1]):
+                if referenced not in order:
+                    order[referenced] = len(reached)
+                    reached.append(referenced)
+
+    canonical = [
+        [
+            records[current]['kind'],
+            records[current]['name'],
+            records[current]['pack'],
+            records[current]['anonymous'],
+            records[current]['fields'] and [
+                [field[0], _remap_records(field[1], order), *field[2:]]
+                for field in records[current]['fields']
+            ],
+        ]
+        for current in reached
+    ]
+    encoded = json.dumps(canonical, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class TypeRegistry:
+    '''Record classes shared by every interface built with the registry.
+
+    Records are interned by record_fingerprint, so interfaces that
+    describe the same struct (e.g. tm from time.h) share its class, and
+    a record of one can be passed to the functions of the other.
+    Classes that are no longer used by any interface are dropped.
+    '''
+
+    def __init__(self):
+        self._classes: typing.MutableMapping[str, type] = \
+            weakref.WeakValueDictionary()
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._classes)
+
+    def get(self, fingerprint: str) -> typing.Optional[type]:
+        return self._classes.get(fingerprint)
+
+    def add(self, fingerprint: str, ctype: type):
+        self._classes[fingerprint] = ctype
+
+    def __reduce__(self):
+        # Registries are per process, only SHARED_TYPES keeps its identity
+        if self is SHARED_TYPES:
+            return 'SHARED_TYPES'
+        return (TypeRegistry, ())
+
+
+# Registry for sharing record classes across the whole process
+SHARED_TYPES = TypeRegistry()
+
+
+class _Builder:
+    '''Creates the record classes of a description on demand.
+
+    A record is created with every record it refers to, so its class is
+    complete (including the targets of its pointers) once handed out.
+    '''
+
+    def __init__(
+            self,
+            records: typing.List[dict],
+            registry: typing.Optional[TypeRegistry] = None,
+    ):
+        self.records = records
+        self.registry = registry
+        self.classes: typing.List[typing.Optional[type]] = \
+            [None] * len(records)
+        self.complete = [False] * len(records)
+        self.lock = registry.lock if registry is not None \
+            else threading.RLock()
+
+    def record_class(self, index: int) -> type:
+        if not self.complete[index]:
+            with self.lock:
+                # Records that are being completed by this thread are
+                # already in classes.
+                if self.classes[index] is None:
+                    self.create_records(index)
+        return self.classes[index]
+
+    def create_records(self, index: int):
+        reached = [index]
+        seen = {index}
+        for current in reached:
+            for field in self.records[current]['fields'] or ():
+                for referenced in _referenced_records(field[1]):
+                    if referenced not in seen and \
+                       self.classes[referenced] is None:
+                        seen.add(referenced)
+                        reached.append(referenced)
+
+        created = {}
+        for current in reached:
+            record = self.records[current]
+            ctype = None
+            if self.registry is not None:
+                fingerprint = record_fingerprint(self.records, current)
+                ctype = self.registry.get(fingerprint)
+            if ctype is None:
+                ctype = type(
+                    record['name'],
+                    (_RECORD_KINDS[record['kind']], ),
+                    {},
+                )
+                RECORD_CLASSES.add(ctype)
+                created[current] = fingerprint \
+                    if self.registry is not None else None
+            self.classes[current] = ctype
+
+        for current in record_completion_order(self.records, created):
+            self.complete_record(current)
+        for current in reached:
+            self.complete[current] = True
+        if self.registry is not None:
+            for (current, fingerprint) in created.items():
+                self.registry.add(fingerprint, self.classes[current])
+
+    def complete_record(self, index: int):
+        record = self.records[index]
+        ctype = self.classes[index]
+        if record['fields'] is None:
+            return
+
+        if record['pack'] is not None:
+            setattr(ctype, '_pack_', record['pack'])
+        if record['anonymous'] is not None:
+            setattr(ctype, '_anonymous_', record['anonymous'])
+        setattr(ctype, '_fields_', [
+            (field[0], self.build_type(field[1]), *field[2:])
+            for field in record['fields']
+        ])
+
+    def build_type(self, ref: typing.Any) -> typing.Optional[type]:
+        if ref is None:
+            return None
+
+        if isinstance(ref, str):
+            return getattr(ctypes, ref)
+
+        kind = ref[0]
+        if kind == 'pointer':
+            return ctypes.POINTER(self.build_type(ref[1]))
+
+        if kind == 'array':
+            return self.build_type(ref[1]) * ref[2]
+
+        if kind == 'function':
+            return ctypes.CFUNCTYPE(
+                self.build_type(ref[2]),
+                *map(self.build_type, ref[3]),
+                use_errno=bool(ref[1] & ctypes._FUNCFLAG_USE_ERRNO),
+                use_last_error=bool(ref[1] & ctypes._FUNCFLAG_USE_LASTERROR),
+            )
+
+        if kind == 'record':
+            return self.record_class(ref[1])
+
+        raise ValueError(ref)
+
+
+def _shared_ref(ref: typing.Any, shared: dict) -> typing.Any:
+    '''An equal ref, the same object as the equal refs seen before'''
+    if isinstance(ref, str):
+        return shared.setdefault(ref, ref)
+    if not isinstance(ref, list):
+        return ref
+
+    items = [_shared_ref(item, shared) for item in ref]
+    # Items are already shared, so equal lists are the same objects
+    key = tuple(
+        ('list', id(item)) if isinstance(item, list) else item
+        for item in items
+    )
+    return shared.setdefault(key, items)
+
+
+def share_refs(description: dict):
+    '''Make equal type references of a description the same objects.
+
+    Descriptions loaded from JSON repeat small lists such as
+    ['pointer', 'c_char'] for every use, this keeps one of each.
+    '''
+    shared: dict = {}
+    for table in ('types', 'symbols'):
+        refs = description[table]
+        for name in refs:
+            refs[name] = _shared_ref(refs[name], shared)
+    for record in description['records']:
+        for field in record['fields'] or ():
+            field[0] = _shared_ref(field[0], shared)
+            field[1] = _shared_ref(field[1], shared)
+
+
+class DescribedTable(collections.abc.Mapping):
+    '''A table of ctypes classes that are built on first access.
+
+    Until then only the type references of the description are kept,
+    which take a fraction of the memory of the classes.
+    '''
+
+    def __init__(self, builder: _Builder, refs: typing.Dict[str, typing.Any]):
+        self._builder = builder
+        self._refs = refs
+        self.built: typing.Dict[str, typing.Optional[type]] = {}
+
+    def __getitem__(self, name: str) -> typing.Optional[type]:
+        try:
+            return self.built[name]
+        except KeyError:
+            pass
+
+        ctype = self._builder.build_type(self._refs[name])
+        self.built[name] = ctype
+        return ctype
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._refs
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._refs)
+
+    def __len__(self) -> int:
+        return len(self._refs)
+
+
+def pending_description(interface: CInterface) -> typing.List[typing.Any]:
+    '''Parts of the description of an interface that weren't built yet'''
+    pending = []
+    builders = {}
+    for table in (interface.types, interface.symbols):
+        if isinstance(table, DescribedTable):
+            pending.extend(
+                ref
+                for (name, ref) in table._refs.items()
+                if name not in table.built
+            )
+            builders[id(table._builder)] = table._builder
+    for builder in builders.values():
+        pending.extend(
+            record
+            for (record, complete) in zip(builder.records, builder.complete)
+            if not complete
+        )
+    return pending
+
+
+def build_interface(
+        description: dict,
+        registry: typing.Optional[TypeRegistry] = None,
+        lazy: bool = False,
+) -> CInterface:
+    '''Create the ctypes classes of a description.
+
+    With a registry, records that are already in it are reused, and the
+    new ones are added to it. With lazy=True, the types and symbols
+    tables are DescribedTables, so classes are only created when looked
+    up (the tables can't be modified).
+    '''
+    builder = _Builder(description['records'], registry)
+    if lazy:
+        types = DescribedTable(builder, description['types'])
+        symbols = DescribedTable(builder, description['symbols'])
+    else:
+        types = {
+            name: builder.build_type(ref)
+            for (name, ref) in description['types'].items()
+        }
+        symbols = {
+            name: builder.build_type(ref)
+            for (name, ref) in description['symbols'].items()
+        }
+
+    return CInterface(
+        types=types,
+        symbols=symbols,
+        enum_consts=dict(description['enum_consts']),
+        variadic=set(description['variadic']),
+    )
+
+
+def _remap_records(ref: typing.Any, remap: typing.List[int]) -> typing.Any:
+    if not isinstance(ref, list):
+        return ref
+
+    kind = ref[0]
+    if kind == 'record':
+        return ['record', remap[ref[1]]]
+    if kind == 'pointer':
+        return ['pointer', _remap_records(ref[1], remap)]
+    if kind == 'array':
+        return ['array', _remap_records(ref[1], remap), ref[2]]
+    if kind == 'function':
+        return [
+            'function',
+            ref[1],
+            _remap_records(ref[2], remap),
+            [_remap_records(x, remap) for x in ref[3]],
+        ]
+    raise ValueError(ref)
+
+
+def merge_descriptions(descriptions: typing.Iterable[dict]) -> dict:
+    '''Combine the descriptions of several translation units.
+
+    Records with the same kind and name are merged into one, a
+    definition takes precedence over an opaque deceleration. Unnamed
+    records are named after their location (see unique_type_name), so
+    they merge too, whichever process described them. For other
+    duplicate names the first description wins.
+    '''
+    merged: typing.Dict[str, typing.Any] = {
+        'types': {},
+        'symbols': {},
+        'enum_consts': {},
+        'variadic': [],
+        'records': [],
+    }
+    record_indices: typing.Dict[typing.Tuple[str, str], int] = {}
+
+    for description in descriptions:
+        remap = []
+        defined_here = []
+        for record in description['records']:
+            key = (record['kind'], record['name'])
+            if key not in record_indices:
+                record_indices[key] = len(merged['records'])
+                merged['records'].append(dict(record, fields=None))
+            index = record_indices[key]
+            remap.append(index)
+            if record['fields'] is not None and \
+               merged['records'][index]['fields'] is None:
+                defined_here.append((index, record))
+
+        # Fields can only be remapped once every record has an index
+        for (index, record) in defined_here:
+            merged['records'][index] = dict(record, fields=[
+                [field[0], _remap_records(field[1], remap), *field[2:]]
+                for field in record['fields']
+            ])
+
+        for table in ('types', 'symbols'):
+            for (name, ref) in description[table].items():
+                if name not in merged[table]:
+                    merged[table][name] = _remap_records(ref, remap)
+
+        for (name, value) in description['enum_consts'].items():
+            merged['enum_consts'].setdefault(name, value)
+
+        merged['variadic'] = sorted({
+            *merged['variadic'],
+            *description['variadic'],
+        })
+
+    return merged
+
+
+# Classes created from descriptions (or while parsing headers) can't be
+# found by their module and name, so they are pickled by their
+# description. Records are interned in SHARED_TYPES, which makes the
+# round trip in the same process return the original classes. Other
+# ctypes classes keep pickle's default behaviour.
+
+_pickled_descriptions: typing.MutableMapping[type, tuple] = \
+    weakref.WeakKeyDictionary()
+
+
+def _is_importable(ctype: type) -> bool:
+    try:
+        found = functools.reduce(
+            getattr,
+            ctype.__qualname__.split('.'),
+            sys.modules[ctype.__module__],
+        )
+    except (KeyError, AttributeError):
+        return False
+    return found is ctype
+
+
+def _created_by_c_import(ctype: typing.Any) -> bool:
+    '''Whether ctype is a record class of c_import, or refers to one'''
+    if not isinstance(ctype, type):
+        return False
+    if ctype in RECORD_CLASSES:
+        return True
+    if issubclass(ctype, (ctypes._Pointer, ctypes.Array)):
+        return _created_by_c_import(ctype._type_)
+    if issubclass(ctype, ctypes._CFuncPtr):
+        return any(map(_created_by_c_import, (
+            getattr(ctype, '_restype_', None),
+            *getattr(ctype, '_argtypes_', ()),
+        )))
+    return False
+
+
+def class_from_description(ref: typing.Any, records: typing.List[dict]) -> type:
+    '''The class of a type reference, with records interned in SHARED_TYPES'''
+    return _Builder(records, SHARED_TYPES).build_type(ref)
+
+
+def _reduce_class(ctype: type):
+    if _is_importable(ctype) or not _created_by_c_import(ctype):
+        return ctype.__qualname__
+
+    try:
+        return (class_from_description, _pickled_descriptions[ctype])
+    except KeyError:
+        pass
+
+    describer = _Describer()
+    ref = describer.describe_type(ctype)
+    with SHARED_TYPES.lock:
+        for (record, index) in describer.record_indices.items():
+            fingerprint = record_fingerprint(describer.records, index)
+            if SHARED_TYPES.get(fingerprint) is None:
+                SHARED_TYPES.add(fingerprint, record)
+    arguments = (ref, describer.records)
+    _pickled_descriptions[ctype] = arguments
+    return (class_from_description, arguments)
+
+
+for _metaclass in {
+        type(ctypes.Structure),
+        type(ctypes.Union),
+        type(ctypes.POINTER(ctypes.c_int)),
+        type(ctypes.c_int * 1),
+        type(ctypes.CFUNCTYPE(None)),
+}:
+    copyreg.pickle(_metaclass, _reduce_class)
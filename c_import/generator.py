@@ -0,0 +1,179 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Generate python modules with static bindings.
+
+The generated modules only depend on ctypes, so they can be imported
+without parsing anything and without libclang.
+'''
+
+import ctypes
+import typing
+
+from c_import.header_parser import CInterface
+import c_import.description
+
+
+_LIBRARY_CLASS = """
+class Library(ctypes.CDLL):
+    '''A CDLL that knows the types of its symbols (see c_import.loader.CDLLX)'''
+
+    def __getitem__(self, item):
+        if item in symbols:
+            ctype = symbols[item]
+            if issubclass(ctype, ctypes._CFuncPtr):
+                return ctype((item, self))
+
+            return ctype.in_dll(self, item)
+
+        if item in enum_consts:
+            return enum_consts[item]
+
+        if item in types:
+            return types[item]
+
+        raise KeyError(item)
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+
+        try:
+            value = self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        setattr(self, name, value)
+        return value
+
+
+def load(library=LIBRARY):
+    return Library(library)
+"""
+
+
+class _Writer:
+    def __init__(self, records: typing.List[dict]):
+        self.records = records
+
+    def record_name(self, index: int) -> str:
+        return f'_record_{index}'
+
+    def type_expression(self, ref: typing.Any) -> str:
+        if ref is None:
+            return 'None'
+
+        if isinstance(ref, str):
+            return f'ctypes.{ref}'
+
+        kind = ref[0]
+        if kind == 'pointer':
+            return f'ctypes.POINTER({self.type_expression(ref[1])})'
+
+        if kind == 'array':
+            return f'({self.type_expression(ref[1])} * {ref[2]})'
+
+        if kind == 'function':
+            arguments = [
+                self.type_expression(ref[2]),
+                *map(self.type_expression, ref[3]),
+            ]
+            if ref[1] & ctypes._FUNCFLAG_USE_ERRNO:
+                arguments.append('use_errno=True')
+            if ref[1] & ctypes._FUNCFLAG_USE_LASTERROR:
+                arguments.append('use_last_error=True')
+            return f'ctypes.CFUNCTYPE({", ".join(arguments)})'
+
+        if kind == 'record':
+            return self.record_name(ref[1])
+
+        raise ValueError(ref)
+
+    def record_lines(self) -> typing.Iterator[str]:
+        for (index, record) in enumerate(self.records):
+            base = 'Structure' if record['kind'] == 'struct' else 'Union'
+            yield f'{self.record_name(index)} = ' \
+                f'type({record["name"]!r}, (ctypes.{base},), {{}})'
+        yield ''
+
+        order = c_import.description.record_completion_order(self.records)
+        for index in order:
+            record = self.records[index]
+            if record['fields'] is None:
+                continue
+            name = self.record_name(index)
+            if record['pack'] is not None:
+                yield f'{name}._pack_ = {record["pack"]!r}'
+            if record['anonymous'] is not None:
+                yield f'{name}._anonymous_ = {record["anonymous"]!r}'
+            yield f'{name}._fields_ = ['
+            for field in record['fields']:
+                items = [
+                    repr(field[0]),
+                    self.type_expression(field[1]),
+                    *map(repr, field[2:]),
+                ]
+                yield f'    ({", ".join(items)}),'
+            yield ']'
+
+    def table_lines(self, name: str, table: dict) -> typing.Iterator[str]:
+        yield f'{name} = {{'
+        for (key, ref) in table.items():
+            yield f'    {key!r}: {self.type_expression(ref)},'
+        yield '}'
+
+
+def generate_module(
+        interface: CInterface,
+        library: typing.Optional[str] = None,
+        comment: typing.Optional[str] = None,
+) -> str:
+    '''Python source of a module with the ctypes classes of interface.
+
+    The module contains the records, a types, symbols and enum_consts
+    table, and a load function that returns a CDLLX like object for
+    library.
+    '''
+    description = c_import.description.describe_interface(interface)
+    writer = _Writer(description['records'])
+
+    lines = ['# Generated by c_import. Do not edit.']
+    if comment is not None:
+        lines.extend(f'# {x}' for x in comment.splitlines())
+    lines.extend((
+        '',
+        'import ctypes',
+        '',
+        f'LIBRARY = {library!r}',
+        '',
+    ))
+    lines.extend(writer.record_lines())
+    lines.append('')
+    lines.extend(writer.table_lines('types', description['types']))
+    lines.append('')
+    lines.extend(writer.table_lines('symbols', description['symbols']))
+    lines.append('')
+    lines.append('enum_consts = {')
+    for (name, value) in description['enum_consts'].items():
+        lines.append(f'    {name!r}: {value!r},')
+    lines.append('}')
+    lines.append('')
+    lines.append(f'variadic = set({sorted(description["variadic"])!r})')
+    lines.append('')
+    lines.append(_LIBRARY_CLASS)
+    return '\n'.join(lines)
@@ -20,11 +20,57 @@
 import typing
 import pathlib
 import ctypes
+import collections
 import dataclasses
+import hashlib
+import heapq
+import operator
+import time
+import fnmatch
+import functools
+import glob
+import json
+import os
+import uuid
+import weakref
 
 import clang
 import clang.cindex
 
+import c_import.cache
+
+
+@dataclasses.dataclass
+class ParseStatistics:
+    # Number of handled top level declarations per cursor kind
+    declarations: collections.Counter = dataclasses.field(
+        default_factory=collections.Counter
+    )
+
+    # Number of ctypes classes created (or taken from ctypes' own caches)
+    ctypes_classes: int = 0
+
+    # Seconds spent inside ctypes creating classes and laying out fields
+    ctypes_seconds: float = 0.0
+
+    # How many of the most expensive declarations to keep
+    max_slowest: int = 20
+
+    # Heap of (seconds, cursor kind, name) of the most expensive declarations
+    _slowest: list = dataclasses.field(default_factory=list, repr=False)
+
+    def add_deceleration(self, cursor: clang.cindex.Cursor, seconds: float):
+        self.declarations[cursor.kind.name] += 1
+        entry = (seconds, cursor.kind.name, cursor.spelling)
+        if len(self._slowest) < self.max_slowest:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    def slowest_declarations(self) -> typing.List[typing.Tuple[float, str, str]]:
+        '''(seconds, cursor kind, name) of the most expensive declarations'''
+        return sorted(self._slowest, reverse=True)
+
 
 @dataclasses.dataclass(frozen=True)
 class CInterface:
@@ -37,6 +83,24 @@ class CInterface:
     # Association between an enum constant and its value
     enum_consts: dict[str, int]
 
+    # Names of the symbols that are variadic functions
+    variadic: set[str] = dataclasses.field(default_factory=set)
+
+    # Association between the spelling of a canonical clang type and
+    # its ctypes type, so each distinct C type is converted once.
+    _type_variants: dict[str, typing.Optional[type]] = dataclasses.field(
+        default_factory=dict,
+        repr=False,
+        compare=False,
+    )
+
+    # Filled while handling declarations, when given
+    _statistics: typing.Optional[ParseStatistics] = dataclasses.field(
+        default=None,
+        repr=False,
+        compare=False,
+    )
+
 
 QUALIFIERS_AND_SPECIFIERS = (
     "const",
@@ -59,7 +123,10 @@ def remove_qualifiers_and_specifiers(name: str) -> str:
 def unique_type_name(clang_type: clang.cindex.Type) -> str:
     '''Generate the name of the ctype type'''
     if clang_type.get_declaration().is_anonymous():
-        return hex(hash(clang_type.get_canonical().spelling))
+        # The spelling holds the location of the declaration. Unlike
+        # hash(), a digest is the same in every process.
+        spelling = clang_type.get_canonical().spelling
+        return '0x' + hashlib.sha256(spelling.encode('utf-8')).hexdigest()[:16]
 
     return remove_qualifiers_and_specifiers(clang_type.spelling)
 
@@ -86,22 +153,53 @@ _CLANG_KIND_CTYPE_MAP = {
     clang.cindex.TypeKind.VOID: None,
 }
 
+# Record classes created by c_import (see c_import.description for pickling)
+RECORD_CLASSES: typing.MutableSet[type] = weakref.WeakSet()
+
+
+def _ctypes_call(scope: CInterface, function, *args, **kwargs):
+    '''Call into ctypes, accounting for it in the statistics of scope'''
+    if scope._statistics is None:
+        return function(*args, **kwargs)
+
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    scope._statistics.ctypes_seconds += time.perf_counter() - start
+    if isinstance(result, type):
+        scope._statistics.ctypes_classes += 1
+    return result
+
+
 def get_type_or_create_variant(
         scope: CInterface,
         clang_type: clang.cindex.Type
 ) -> typing.Optional[type]:
     assert clang_type.spelling
 
-    # TODO: Handle anonymous and opaque types
-
     if clang_type.kind in _CLANG_KIND_CTYPE_MAP:
         return _CLANG_KIND_CTYPE_MAP[clang_type.kind]
 
+    key = clang_type.get_canonical().spelling
+    if key not in scope._type_variants:
+        scope._type_variants[key] = create_type_variant(scope, clang_type)
+    return scope._type_variants[key]
+
+
+def create_type_variant(
+        scope: CInterface,
+        clang_type: clang.cindex.Type
+) -> typing.Optional[type]:
+    # TODO: Handle anonymous and opaque types
+
     if clang_type.kind == clang.cindex.TypeKind.INVALID:
         raise ValueError
 
     if clang_type.kind == clang.cindex.TypeKind.POINTER:
-        return ctypes.POINTER(get_type_or_create_variant(scope, clang_type.get_pointee()))
+        return _ctypes_call(
+            scope,
+            ctypes.POINTER,
+            get_type_or_create_variant(scope, clang_type.get_pointee()),
+        )
 
     if clang_type.kind in (
             clang.cindex.TypeKind.CONSTANTARRAY,
@@ -112,11 +210,18 @@ def get_type_or_create_variant(
             clang_type.element_type
         )
         assert element_ctype is not None
-        return element_ctype * clang_type.element_count
+        return _ctypes_call(
+            scope,
+            operator.mul,
+            element_ctype,
+            clang_type.element_count,
+        )
 
     if clang_type.kind == clang.cindex.TypeKind.FUNCTIONPROTO:
         assert not clang_type.is_function_variadic()
-        return ctypes.CFUNCTYPE(
+        return _ctypes_call(
+            scope,
+            ctypes.CFUNCTYPE,
             get_type_or_create_variant(scope, clang_type.get_result()),
             *map(
                 lambda x: get_type_or_create_variant(scope, x),
@@ -125,7 +230,11 @@ def get_type_or_create_variant(
         )
 
     if clang_type.kind == clang.cindex.TypeKind.INCOMPLETEARRAY:
-        return ctypes.POINTER(get_type_or_create_variant(scope, clang_type.element_type))
+        return _ctypes_call(
+            scope,
+            ctypes.POINTER,
+            get_type_or_create_variant(scope, clang_type.element_type),
+        )
 
     if clang_type.kind in (
             clang.cindex.TypeKind.TYPEDEF,
@@ -136,7 +245,11 @@ def get_type_or_create_variant(
     if clang_type.kind == clang.cindex.TypeKind.RECORD:
         type_id = unique_type_name(clang_type)
         if type_id not in scope.types:
-            handle_struct_deceleration(scope, clang_type.get_declaration())
+            declaration = clang_type.get_declaration()
+            if declaration.kind == clang.cindex.CursorKind.UNION_DECL:
+                handle_union_deceleration(scope, declaration)
+            else:
+                handle_struct_deceleration(scope, declaration)
         return scope.types[type_id]
 
     raise NotImplementedError(clang_type.kind)
@@ -198,11 +311,12 @@ def handle_type_deceleration_body(
     if len(anon_types_to_add) != 0:
         for anon_type in map(lambda x: scope.types[x], anon_types_to_add):
             if not hasattr(anon_type, '_fields_'):
-                setattr(anon_type, '_fields_', [])
+                _ctypes_call(scope, setattr, anon_type, '_fields_', [])
         setattr(empty_type, '_anonymous_', anon_types_to_add)
 
     if len(fields_to_add) != 0:
-        setattr(empty_type, '_fields_', fields_to_add)
+        # Setting _fields_ is when ctypes lays out the type
+        _ctypes_call(scope, setattr, empty_type, '_fields_', fields_to_add)
 
 
 def add_type_with_fields(
@@ -222,7 +336,8 @@ def add_type_with_fields(
         assert ctype is not None
     else:
         # Create a new ctypes class
-        ctype = type(type_name, (ctypes_type, ), {})
+        ctype = _ctypes_call(scope, type, type_name, (ctypes_type, ), {})
+        RECORD_CLASSES.add(ctype)
 
     assert " " not in type_name
     scope.types[type_name] = ctype  # Add refrence to table
@@ -270,20 +385,51 @@ def handle_var_deceleration(scope: CInterface, cursor: clang.cindex.Cursor):
     scope.symbols[cursor.spelling] = var_type
 
 
+def _function_key(cursor: clang.cindex.Cursor) -> str:
+    '''Memo key of the prototype of a function deceleration.
+
+    Redeclarations share their canonical type. Functions without a
+    prototype get their arguments from the deceleration, so those are
+    part of the key.
+    '''
+    function_type = cursor.type.get_canonical()
+    if function_type.kind == clang.cindex.TypeKind.FUNCTIONPROTO:
+        return function_type.spelling
+    return ', '.join((
+        function_type.spelling,
+        *(x.type.get_canonical().spelling for x in cursor.get_arguments()),
+    ))
+
+
 def handle_function_deceleration(
         scope: CInterface,
         cursor: clang.cindex.Cursor
 ):
     # TODO: Handle stdcall
     assert cursor.kind == clang.cindex.CursorKind.FUNCTION_DECL
-    function = ctypes.CFUNCTYPE(
-        get_type_or_create_variant(scope, cursor.result_type),
-        *map(
-            lambda x:get_type_or_create_variant(scope, x.type),
-            cursor.get_arguments(),
+
+    key = _function_key(cursor)
+    if key not in scope._type_variants:
+        function_type = cursor.type.get_canonical()
+        if function_type.kind == clang.cindex.TypeKind.FUNCTIONPROTO:
+            # Array parameters are already adjusted to pointers here
+            argument_types = list(function_type.argument_types())
+        else:
+            argument_types = [x.type for x in cursor.get_arguments()]
+        scope._type_variants[key] = _ctypes_call(
+            scope,
+            ctypes.CFUNCTYPE,
+            get_type_or_create_variant(scope, function_type.get_result()),
+            *map(
+                lambda x:get_type_or_create_variant(scope, x),
+                argument_types,
+            )
         )
-    )
-    scope.symbols[cursor.spelling] = function
+    scope.symbols[cursor.spelling] = scope._type_variants[key]
+    function_type = cursor.type.get_canonical()
+    if function_type.kind == clang.cindex.TypeKind.FUNCTIONPROTO and \
+       function_type.is_function_variadic():
+        scope.variadic.add(cursor.spelling)
 
 
 def handle_static_assert(*args, **kwargs):
@@ -307,7 +453,14 @@ def handle_deceleration(scope: CInterface, cursor: clang.cindex.Cursor):
     assert cursor.kind.is_declaration()
     if cursor.kind not in _DECELERATION_HANDLER:
         raise NotImplementedError(cursor.kind)
+
+    if scope._statistics is None:
+        _DECELERATION_HANDLER[cursor.kind](scope, cursor)
+        return
+
+    start = time.perf_counter()
     _DECELERATION_HANDLER[cursor.kind](scope, cursor)
+    scope._statistics.add_deceleration(cursor, time.perf_counter() - start)
 
 
 def handle_translation_unit(scope: CInterface, cursor: clang.cindex.Cursor):
@@ -316,11 +469,651 @@ def handle_translation_unit(scope: CInterface, cursor: clang.cindex.Cursor):
         handle_deceleration(scope, child)
 
 
-def parse_header(header: pathlib.Path) -> CInterface:
-    scope = CInterface(types={}, symbols={}, enum_consts={})
-    handle_translation_unit(
-        scope,
-        clang.cindex.Index.create().parse(header).cursor
+@dataclasses.dataclass(frozen=True)
+class DeclarationIndex:
+    '''Top level declarations of a translation unit, by name.
+
+    Used to handle only the declarations that are actually needed.
+    '''
+
+    # Keeps the cursors valid
+    translation_unit: clang.cindex.TranslationUnit
+
+    # Association between a symbol and its deceleration
+    symbols: dict[str, clang.cindex.Cursor]
+
+    # Association between type name and its deceleration
+    types: dict[str, clang.cindex.Cursor]
+
+    # Association between an enum constant and the deceleration of its enum
+    enum_consts: dict[str, clang.cindex.Cursor]
+
+
+@dataclasses.dataclass(frozen=True)
+class DeclarationFilter:
+    '''Selects the declarations to handle.
+
+    A deceleration is selected when its name is in names or starts with
+    one of prefixes, and it is located in a file that matches one of the
+    fnmatch patterns in locations. Leaving out a criteria selects
+    everything. Types referenced by selected declarations are handled
+    as well.
+
+    headers_only adds the files the main source includes directly to
+    locations, once the translation unit tells which files they are.
+    '''
+
+    names: typing.Optional[frozenset[str]] = None
+
+    prefixes: tuple[str, ...] = ()
+
+    locations: typing.Optional[tuple[str, ...]] = None
+
+    headers_only: bool = False
+
+    def with_included_files(
+            self,
+            paths: typing.Iterable[str],
+    ) -> 'DeclarationFilter':
+        '''Resolve headers_only to the given directly included files'''
+        return dataclasses.replace(
+            self,
+            locations=(
+                *(self.locations or ()),
+                *sorted(glob.escape(os.path.normpath(x)) for x in paths),
+            ),
+            headers_only=False,
+        )
+
+    def wants_name(self, name: str) -> bool:
+        if self.names is None and not self.prefixes:
+            return True
+        return (self.names is not None and name in self.names) or \
+            name.startswith(self.prefixes)
+
+    def wants_location(self, path: typing.Optional[str]) -> bool:
+        if self.locations is None:
+            return True
+        if path is None:
+            return False
+        path = os.path.normpath(path)
+        return any(fnmatch.fnmatchcase(path, x) for x in self.locations)
+
+
+@functools.cache
+def _get_presumed_location():
+    # Not wrapped by the python bindings
+    function = clang.cindex.conf.lib.clang_getPresumedLocation
+    function.argtypes = [
+        clang.cindex.SourceLocation,
+        ctypes.POINTER(clang.cindex._CXString),
+        ctypes.POINTER(ctypes.c_uint),
+        ctypes.POINTER(ctypes.c_uint),
+    ]
+    function.restype = None
+    return function
+
+
+def presumed_file_name(
+        location: clang.cindex.SourceLocation
+) -> typing.Optional[str]:
+    '''Name of the file of a location, according to line markers.
+
+    Declarations parsed from cpp's output are all physically located in
+    the same in-memory file.
+    '''
+    file_name = clang.cindex._CXString()
+    line = ctypes.c_uint()
+    column = ctypes.c_uint()
+    _get_presumed_location()(
+        location,
+        ctypes.byref(file_name),
+        ctypes.byref(line),
+        ctypes.byref(column),
+    )
+    return clang.cindex._CXString.from_result(file_name) or None
+
+
+@functools.cache
+def _get_file_contents():
+    # Not wrapped by the python bindings
+    function = clang.cindex.conf.lib.clang_getFileContents
+    function.argtypes = [
+        clang.cindex.TranslationUnit,
+        clang.cindex.File,
+        ctypes.POINTER(ctypes.c_size_t),
+    ]
+    function.restype = ctypes.c_void_p
+    return function
+
+
+def directly_included_files(
+        translation_unit: clang.cindex.TranslationUnit
+) -> typing.Set[str]:
+    '''Files included by the main file of a translation unit itself
+
+    Those are found by libclang when it did the pre-processing, and in
+    the linemarkers of the main file when it is cpp's output.
+    '''
+    included = {
+        str(inclusion.include)
+        for inclusion in translation_unit.get_includes()
+        if inclusion.depth == 1
+    }
+    main_file = translation_unit.get_file(translation_unit.spelling)
+    size = ctypes.c_size_t()
+    contents = _get_file_contents()(
+        translation_unit,
+        main_file,
+        ctypes.byref(size),
+    )
+    if contents:
+        included |= c_import.cache.directly_included_files(
+            ctypes.string_at(contents, size.value).decode('utf-8', 'replace')
+        )
+    return included
+
+
+_TYPE_DECELERATIONS = (
+    clang.cindex.CursorKind.TYPEDEF_DECL,
+    clang.cindex.CursorKind.STRUCT_DECL,
+    clang.cindex.CursorKind.UNION_DECL,
+    clang.cindex.CursorKind.ENUM_DECL,
+)
+
+_SYMBOL_DECELERATIONS = (
+    clang.cindex.CursorKind.VAR_DECL,
+    clang.cindex.CursorKind.FUNCTION_DECL,
+)
+
+def index_translation_unit(
+        translation_unit: clang.cindex.TranslationUnit,
+        declaration_filter: typing.Optional[DeclarationFilter] = None,
+) -> DeclarationIndex:
+    if declaration_filter is not None and declaration_filter.headers_only:
+        declaration_filter = declaration_filter.with_included_files(
+            directly_included_files(translation_unit)
+        )
+
+    def wants_name(name: str) -> bool:
+        return declaration_filter is None or declaration_filter.wants_name(name)
+
+    wanted_files: typing.Dict[typing.Optional[str], bool] = {}
+    def wants_location(cursor: clang.cindex.Cursor) -> bool:
+        if declaration_filter is None or declaration_filter.locations is None:
+            return True
+        path = presumed_file_name(cursor.location)
+        if path not in wanted_files:
+            wanted_files[path] = declaration_filter.wants_location(path)
+        return wanted_files[path]
+
+    index = DeclarationIndex(
+        translation_unit=translation_unit,
+        symbols={},
+        types={},
+        enum_consts={},
+    )
+    for child in translation_unit.cursor.get_children():
+        assert child.kind.is_declaration()
+        if child.kind not in _DECELERATION_HANDLER:
+            raise NotImplementedError(child.kind)
+
+        if not wants_location(child):
+            continue
+
+        if child.kind in _SYMBOL_DECELERATIONS:
+            if wants_name(child.spelling):
+                index.symbols[child.spelling] = child
+
+        elif child.kind in _TYPE_DECELERATIONS:
+            type_name = child.spelling \
+                if child.kind == clang.cindex.CursorKind.TYPEDEF_DECL \
+                   else unique_type_name(child.type)
+
+            # Don't replace a definition with a forward deceleration
+            if wants_name(type_name) and \
+               (child.is_definition() or type_name not in index.types):
+                index.types[type_name] = child
+
+            if child.kind == clang.cindex.CursorKind.ENUM_DECL:
+                for constant in child.get_children():
+                    if wants_name(constant.spelling):
+                        index.enum_consts[constant.spelling] = child
+
+    return index
+
+
+def _index_tables(scope: CInterface, index: DeclarationIndex):
+    '''Pairs of tables in lookup order'''
+    return (
+        (scope.symbols, index.symbols),
+        (scope.enum_consts, index.enum_consts),
+        (scope.types, index.types),
+    )
+
+
+def handle_indexed_deceleration(
+        scope: CInterface,
+        index: DeclarationIndex,
+        name: str
+) -> bool:
+    '''Handle the deceleration of name, unless its already in scope.
+
+    Returns False when name isn't declared.
+    '''
+    for (scope_table, index_table) in _index_tables(scope, index):
+        if name in scope_table:
+            return True
+        if name in index_table:
+            handle_deceleration(scope, index_table[name])
+            return True
+    return False
+
+
+def handle_index(scope: CInterface, index: DeclarationIndex):
+    '''Handle every deceleration in the index'''
+    for (scope_table, index_table) in _index_tables(scope, index):
+        for (name, cursor) in index_table.items():
+            if name not in scope_table:
+                handle_deceleration(scope, cursor)
+
+
+def referenced_types(ctype: typing.Optional[type]) -> typing.Iterator[type]:
+    '''ctypes classes a type directly refers to'''
+    if ctype is None:
+        return
+
+    if issubclass(ctype, (ctypes._Pointer, ctypes.Array)):
+        yield ctype._type_
+
+    elif issubclass(ctype, ctypes._CFuncPtr):
+        if ctype._restype_ is not None:
+            yield ctype._restype_
+        yield from ctype._argtypes_
+
+    elif issubclass(ctype, (ctypes.Structure, ctypes.Union)):
+        for field in ctype.__dict__.get('_fields_', ()):
+            yield field[1]
+
+
+def _handled_type(
+        scope: CInterface,
+        clang_type: clang.cindex.Type
+) -> typing.Any:
+    '''The ctypes type of clang_type in scope, without creating it'''
+    clang_type = clang_type.get_canonical()
+    if clang_type.kind in _CLANG_KIND_CTYPE_MAP:
+        return _CLANG_KIND_CTYPE_MAP[clang_type.kind]
+
+    if clang_type.kind == clang.cindex.TypeKind.RECORD:
+        return scope.types.get(unique_type_name(clang_type), _UNHANDLED)
+
+    return scope._type_variants.get(clang_type.spelling, _UNHANDLED)
+
+
+def _record_is_up_to_date(
+        scope: CInterface,
+        cursor: clang.cindex.Cursor,
+        ctype: typing.Any,
+        checked: typing.Set[type],
+) -> bool:
+    '''Check that a ctypes record still matches its deceleration'''
+    base = ctypes.Union \
+        if cursor.kind == clang.cindex.CursorKind.UNION_DECL \
+        else ctypes.Structure
+    if not isinstance(ctype, type) or not issubclass(ctype, base):
+        return False
+    if ctype in checked:
+        return True
+    checked.add(ctype)
+
+    # Opaque records may have gotten empty fields as anonymous members
+    fields = ctype.__dict__.get('_fields_')
+    if not cursor.is_definition():
+        return not fields
+    fields_by_name = {field[0]: field[1] for field in fields or ()}
+
+    # Mirrors handle_type_deceleration_body
+    expected: typing.List[tuple] = []
+    pack_value = None
+    for child in cursor.get_children():
+        if child.kind == clang.cindex.CursorKind.FIELD_DECL:
+            field = (child.spelling, _handled_type(scope, child.type))
+            if child.is_bitfield():
+                field += (child.get_bitfield_width(), )
+            expected.append(field)
+
+        elif child.kind == clang.cindex.CursorKind.PACKED_ATTR:
+            pack_value = 1
+
+        elif child.kind in (
+                clang.cindex.CursorKind.STRUCT_DECL,
+                clang.cindex.CursorKind.UNION_DECL,
+        ):
+            name = unique_type_name(child.type)
+            nested = fields_by_name.get(name, scope.types.get(name))
+            if not _record_is_up_to_date(scope, child, nested, checked):
+                return False
+            if name in fields_by_name:
+                expected.append((name, nested))
+
+    return expected == list(fields or ()) and \
+        ctype.__dict__.get('_pack_') == pack_value
+
+
+def _is_up_to_date(
+        scope: CInterface,
+        name: str,
+        cursor: clang.cindex.Cursor,
+        value: typing.Any
+) -> bool:
+    '''Check that value is what handling cursor would produce now.
+
+    Only the ctypes classes that are already in scope are compared, a
+    class that refers to a stale class is found by update_interface.
+    '''
+    if cursor.kind == clang.cindex.CursorKind.FUNCTION_DECL:
+        key = _function_key(cursor)
+        return scope._type_variants.get(key, _UNHANDLED) is value
+
+    if cursor.kind == clang.cindex.CursorKind.VAR_DECL:
+        return _handled_type(scope, cursor.type) is value
+
+    if cursor.kind == clang.cindex.CursorKind.TYPEDEF_DECL:
+        return _handled_type(scope, cursor.underlying_typedef_type) is value
+
+    if cursor.kind == clang.cindex.CursorKind.ENUM_DECL:
+        if value is ctypes.c_int:
+            return True
+        return any(
+            child.spelling == name and child.enum_value == value
+            for child in cursor.get_children()
+        )
+
+    return _record_is_up_to_date(scope, cursor, value, set())
+
+
+_UNHANDLED = object()
+
+
+def update_interface(
+        scope: CInterface,
+        index: DeclarationIndex,
+        handle: bool = True,
+) -> typing.Set[str]:
+    '''Bring scope up to date with a new index of its translation unit.
+
+    The declarations that changed or are gone, and every type or symbol
+    that refers to their ctypes classes, are removed from scope.
+    Everything else keeps its ctypes classes.
+
+    When handle is True, the removed declarations are handled again
+    from index, otherwise they are left to handle_indexed_deceleration.
+
+    Returns the names that were removed, and the ones that were added
+    by handling the index.
+    '''
+    stale_names: typing.Set[str] = set()
+    unindexed_names: typing.Set[str] = set()
+    for (scope_table, index_table) in _index_tables(scope, index):
+        for (name, value) in scope_table.items():
+            if name not in index_table:
+                unindexed_names.add(name)
+            elif not _is_up_to_date(scope, name, index_table[name], value):
+                stale_names.add(name)
+
+    # Anything that refers to a stale class, directly or not, is stale
+    # too. Anonymous records are only reachable through their parents.
+    referrers: typing.Dict[type, typing.Set[typing.Any]] = \
+        collections.defaultdict(set)
+    for (name, ctype) in (*scope.types.items(), *scope.symbols.items()):
+        referrers[ctype].add(name)
+    for ctype in (*scope.types.values(), *scope._type_variants.values()):
+        if ctype is None:
+            continue
+        for referenced in referenced_types(ctype):
+            referrers[referenced].add(ctype)
+            if issubclass(ctype, (ctypes.Structure, ctypes.Union)) and \
+               not referenced.__name__.isidentifier():
+                referrers[ctype].add(referenced)
+
+    stale_types = {
+        scope.types[name]
+        for name in stale_names
+        if name in scope.types and
+        issubclass(scope.types[name], (ctypes.Structure, ctypes.Union))
+    }
+    pending = list(stale_types)
+    while pending:
+        for referrer in referrers.get(pending.pop(), ()):
+            if isinstance(referrer, str):
+                stale_names.add(referrer)
+            elif referrer not in stale_types:
+                stale_types.add(referrer)
+                pending.append(referrer)
+
+    # Names that aren't indexed are either gone, or are records that are
+    # nested or implicit (like __va_list_tag). Keep the ones that are
+    # still referred to.
+    reachable: typing.Set[type] = set()
+    pending = [
+        value
+        for (scope_table, index_table) in _index_tables(scope, index)
+        for (name, value) in scope_table.items()
+        if name in index_table and name not in stale_names and
+        isinstance(value, type) and value not in stale_types
+    ]
+    while pending:
+        ctype = pending.pop()
+        if ctype not in reachable:
+            reachable.add(ctype)
+            pending.extend(referenced_types(ctype))
+    for (scope_table, _) in _index_tables(scope, index):
+        for name in unindexed_names.intersection(scope_table):
+            value = scope_table[name]
+            if not (isinstance(value, type) and
+                    issubclass(value, (ctypes.Structure, ctypes.Union)) and
+                    value in reachable):
+                stale_names.add(name)
+
+    for table in (scope.types, scope.symbols, scope.enum_consts):
+        for name in stale_names.intersection(table):
+            del table[name]
+    for (name, ctype) in list(scope.types.items()):
+        if ctype in stale_types:
+            del scope.types[name]
+            stale_names.add(name)
+    scope.variadic.difference_update(stale_names)
+    for (key, ctype) in list(scope._type_variants.items()):
+        if ctype in stale_types:
+            del scope._type_variants[key]
+
+    if not handle:
+        return stale_names
+
+    names = {*scope.types, *scope.symbols, *scope.enum_consts}
+    handle_index(scope, index)
+    return stale_names.union(
+        scope.types.keys() - names,
+        scope.symbols.keys() - names,
+        scope.enum_consts.keys() - names,
+    )
+
+
+def clang_version() -> str:
+    '''Version string of the loaded libclang'''
+    # Not wrapped by the python bindings
+    get_version = clang.cindex.conf.lib.clang_getClangVersion
+    get_version.restype = clang.cindex._CXString
+    return clang.cindex._CXString.from_result(get_version())
+
+
+# Name of the in-memory file given to libclang by parse_source
+SOURCE_FILE_NAME = 'c_import_source.h'
+
+
+def check_diagnostics(translation_unit: clang.cindex.TranslationUnit):
+    fatal_errors = [
+        str(diagnostic)
+        for diagnostic in translation_unit.diagnostics
+        if diagnostic.severity >= clang.cindex.Diagnostic.Fatal
+    ]
+    if fatal_errors:
+        raise clang.cindex.TranslationUnitLoadError('\n'.join(fatal_errors))
+
+
+def parse_source_translation_unit(
+        source: str,
+        clang_args: typing.Sequence[str] = (),
+) -> clang.cindex.TranslationUnit:
+    '''Parse C code that only exists in memory'''
+    translation_unit = clang.cindex.Index.create().parse(
+        SOURCE_FILE_NAME,
+        args=list(clang_args),
+        unsaved_files=[(SOURCE_FILE_NAME, source)],
     )
+    check_diagnostics(translation_unit)
+    return translation_unit
+
+
+def included_files(
+        translation_unit: clang.cindex.TranslationUnit
+) -> typing.Set[str]:
+    return {
+        str(inclusion.include)
+        for inclusion in translation_unit.get_includes()
+    }
+
+
+def interface_from_translation_unit(
+        translation_unit: clang.cindex.TranslationUnit,
+        declaration_filter: typing.Optional[DeclarationFilter] = None,
+        statistics: typing.Optional[ParseStatistics] = None,
+) -> CInterface:
+    scope = CInterface(
+        types={},
+        symbols={},
+        enum_consts={},
+        _statistics=statistics,
+    )
+    if declaration_filter is None:
+        handle_translation_unit(scope, translation_unit.cursor)
+    else:
+        handle_index(
+            scope,
+            index_translation_unit(translation_unit, declaration_filter),
+        )
     assert "" not in scope.types.keys()
     return scope
+
+
+def parse_source(
+        source: str,
+        clang_args: typing.Sequence[str] = (),
+) -> CInterface:
+    return interface_from_translation_unit(
+        parse_source_translation_unit(source, clang_args)
+    )
+
+
+class TranslationUnitCache:
+    '''Directory of translation units saved by libclang.
+
+    Every entry is a json manifest that names an AST file and records the
+    digests of the files it was parsed from. AST files are never
+    overwritten, so a reader sees the AST its manifest refers to, or
+    none at all once it was swept.
+    '''
+
+    def __init__(self, directory: typing.Union[str, pathlib.Path]):
+        self.directory = pathlib.Path(directory)
+
+    def _manifest_path(self, key: str) -> pathlib.Path:
+        return self.directory / f'{key}.ast.json'
+
+    def _read_manifest(self, key: str) -> typing.Optional[dict]:
+        try:
+            with open(self._manifest_path(key), 'rb') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(
+            self,
+            key: str
+    ) -> typing.Optional[typing.Tuple[clang.cindex.TranslationUnit, typing.Set[str]]]:
+        '''Get the translation unit stored under key and its dependencies.
+
+        Returns None if its missing or stale.
+        '''
+        manifest = self._read_manifest(key)
+        if manifest is None or \
+           not c_import.cache.files_unchanged(manifest['dependencies']):
+            return None
+
+        try:
+            translation_unit = clang.cindex.TranslationUnit.from_ast_file(
+                str(self.directory / manifest['ast'])
+            )
+        except clang.cindex.TranslationUnitLoadError:
+            # Replaced by another process
+            return None
+
+        return (translation_unit, set(manifest['dependencies']))
+
+    def store(
+            self,
+            key: str,
+            translation_unit: clang.cindex.TranslationUnit,
+            dependencies: typing.Iterable[str]
+    ):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        ast_name = f'{key}.{uuid.uuid4().hex}.ast'
+        translation_unit.save(str(self.directory / ast_name))
+        c_import.cache.atomic_write(
+            self._manifest_path(key),
+            json.dumps({
+                'ast': ast_name,
+                'dependencies': c_import.cache.digest_files(dependencies),
+            }).encode('utf-8'),
+        )
+
+        # Concurrent writers may have replaced the manifest in between:
+        # sweep every AST of the key that the manifest in place does not
+        # refer to, ours included. At worst a writer that has yet to
+        # replace the manifest loses its AST, which is a cache miss.
+        current = self._read_manifest(key)
+        for path in self.directory.glob(f'{key}.*.ast'):
+            if current is None or path.name != current['ast']:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+def parse_header(
+        header: pathlib.Path,
+        ast_cache_dir: typing.Optional[pathlib.Path] = None
+) -> CInterface:
+    if ast_cache_dir is None:
+        return interface_from_translation_unit(
+            clang.cindex.Index.create().parse(header)
+        )
+
+    ast_cache = TranslationUnitCache(ast_cache_dir)
+    key = c_import.cache.request_key(
+        header=os.path.abspath(header),
+        clang_version=clang_version(),
+    )
+    cached = ast_cache.load(key)
+    if cached is not None:
+        return interface_from_translation_unit(cached[0])
+
+    translation_unit = clang.cindex.Index.create().parse(header)
+    ast_cache.store(
+        key,
+        translation_unit,
+        {os.path.abspath(header), *included_files(translation_unit)},
+    )
+    return interface_from_translation_unit(translation_unit)
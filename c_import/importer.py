@@ -0,0 +1,111 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Import registered libraries as modules of c_import.libs.
+
+    c_import.importer.register('libc', 'libc.so.6', ['stdio.h'])
+    import c_import.libs.libc
+
+The module is the CDLLX of the library. Interfaces are kept in the
+interface cache (see c_import.cache), so headers are only parsed again
+when one of them changed.
+
+Libraries can also be registered with a json file that maps module names
+to the keyword arguments of c_import.loader.load, named by the
+C_IMPORT_LIBS environment variable.
+'''
+
+import importlib.abc
+import importlib.machinery
+import json
+import os
+import pathlib
+import sys
+import typing
+
+import c_import.loader
+
+
+PACKAGE = 'c_import.libs'
+
+# Association between a module name and the keyword arguments of load
+_SPECS: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+
+
+def default_cache_dir() -> pathlib.Path:
+    if 'C_IMPORT_CACHE_DIR' in os.environ:
+        return pathlib.Path(os.environ['C_IMPORT_CACHE_DIR'])
+    cache_home = os.environ.get(
+        'XDG_CACHE_HOME',
+        os.path.join(os.path.expanduser('~'), '.cache'),
+    )
+    return pathlib.Path(cache_home) / 'c_import'
+
+
+def register(
+        name: str,
+        library,
+        headers: typing.Sequence[pathlib.Path],
+        **load_kwargs
+):
+    '''Make the library importable as c_import.libs.<name>'''
+    assert '.' not in name
+    _SPECS[name] = dict(library=library, headers=headers, **load_kwargs)
+
+
+def unregister(name: str):
+    del _SPECS[name]
+    sys.modules.pop(f'{PACKAGE}.{name}', None)
+
+
+def register_file(path: typing.Union[str, pathlib.Path]):
+    with open(path, encoding='utf-8') as f:
+        for (name, spec) in json.load(f).items():
+            register(name, **spec)
+
+
+class _LibraryLoader(importlib.abc.Loader):
+    def __init__(self, name: str):
+        self.name = name
+
+    def create_module(self, spec: importlib.machinery.ModuleSpec):
+        load_kwargs = dict(_SPECS[self.name])
+        load_kwargs.setdefault('cache_dir', default_cache_dir())
+        return c_import.loader.load(**load_kwargs)
+
+    def exec_module(self, module):
+        # Everything happens in create_module
+        pass
+
+
+class LibraryFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname: str, path, target=None):
+        (package, _, name) = fullname.rpartition('.')
+        if package != PACKAGE or name not in _SPECS:
+            return None
+        return importlib.machinery.ModuleSpec(fullname, _LibraryLoader(name))
+
+
+_FINDER = LibraryFinder()
+
+def install():
+    if _FINDER not in sys.meta_path:
+        sys.meta_path.append(_FINDER)
+    if 'C_IMPORT_LIBS' in os.environ:
+        register_file(os.environ['C_IMPORT_LIBS'])
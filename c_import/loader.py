@@ -17,78 +17,1086 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import asyncio
 import ctypes
 import typing
 import pathlib
-import tempfile
+import glob
 import os
+import pickle
+import re
+import shlex
 import subprocess
+import sysconfig
+import threading
+import concurrent.futures
+import contextlib
+import dataclasses
+import functools
+import sys
+import time
+
+import clang.cindex
 
 import c_import.header_parser
+import c_import.description
+import c_import.cache
+import c_import.shared
 
 
-def preprocess_headers(
-        headers: typing.Sequence[pathlib.Path],
+def resolve_cpp(
         cpp_command: typing.Optional[str] = None,
         cpp_flags: typing.Optional[str] = None,
-):
-    # Common mistake
-    assert not isinstance(headers, str), 'headrs should be a list of paths, not a single path!'
-
+) -> typing.Tuple[str, typing.Optional[str]]:
+    '''Fill in the pre-processor command and flags from the environment'''
     if cpp_command is None:
         cpp_command = os.environ.get('CPP', 'cpp')
 
     if cpp_flags is None:
         cpp_flags = os.environ.get('CPPFLAGS', None)
 
-    with tempfile.NamedTemporaryFile(
-            mode='w',
-            suffix='.h',
-            encoding='utf-8'
-    ) as include_all_file:
-        for header_file in headers:
-            include_all_file.write(f'#include <{header_file}>\n')
-        include_all_file.flush()
-        command = [cpp_command, include_all_file.name]
-        if cpp_flags is not None:
-            command.append(cpp_flags)
-        return subprocess.run(
-            command,
-            check=True,
-            encoding='utf-8',
-            stdout=subprocess.PIPE,
-        ).stdout
+    return (cpp_command, cpp_flags)
+
+
+@dataclasses.dataclass
+class LoadStatistics:
+    # Seconds spent in every phase of the load, in the order they ran
+    phases: dict[str, float] = dataclasses.field(default_factory=dict)
+
+    # Size of cpp's output
+    preprocessed_bytes: int = 0
+
+    # Statistics of handling the declarations, when the headers were parsed
+    parse: typing.Optional[c_import.header_parser.ParseStatistics] = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                time.perf_counter() - start
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.phases.values())
+
+
+# Called with the CDLLX and its LoadStatistics after every load
+STATISTICS_HOOKS: typing.List[typing.Callable[['CDLLX', LoadStatistics], None]] = []
+
+
+# C's default argument promotions, applied to the arguments of a variadic
+# function that are passed in place of its ellipsis
+_PROMOTED_ARGTYPES = {
+    ctypes.c_float: ctypes.c_double,
+    ctypes.c_bool: ctypes.c_int,
+    ctypes.c_char: ctypes.c_int,
+    ctypes.c_byte: ctypes.c_int,
+    ctypes.c_ubyte: ctypes.c_int,
+    ctypes.c_short: ctypes.c_int,
+    ctypes.c_ushort: ctypes.c_int,
+}
+
+
+def promote_argtype(argtype: type) -> type:
+    return _PROMOTED_ARGTYPES.get(argtype, argtype)
+
+
+@functools.cache
+def function_type(
+        flags: int,
+        restype: typing.Optional[type],
+        *argtypes: type,
+) -> type:
+    '''A function prototype with any combination of ctypes' _FUNCFLAG_s.
+
+    Like CFUNCTYPE and PYFUNCTYPE, which only expose some of them.
+    '''
+    class FunctionType(ctypes._CFuncPtr):
+        _flags_ = flags
+        _restype_ = restype
+        _argtypes_ = argtypes
+    return FunctionType
+
+
+def object_size(value: typing.Any) -> int:
+    '''Approximate bytes used by a value made of containers and scalars'''
+    size = 0
+    seen = set()
+    pending = [value]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            pending.extend(current.keys())
+            pending.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            pending.extend(current)
+    return size
+
+
+def _ctype_kind(ctype: type) -> typing.Optional[str]:
+    if issubclass(ctype, (ctypes.Structure, ctypes.Union)):
+        return 'records'
+    if issubclass(ctype, ctypes._Pointer):
+        return 'pointers'
+    if issubclass(ctype, ctypes.Array):
+        return 'arrays'
+    if issubclass(ctype, ctypes._CFuncPtr):
+        return 'functions'
+    # Fundamental types are shared by every library
+    return None
+
+
+def ctypes_footprint(ctypes_classes: typing.Iterable[type]) -> typing.Dict[str, int]:
+    '''Approximate bytes used by ctypes classes, by kind.
+
+    Includes the classes they refer to (fields, pointer targets,
+    arguments...), every class is counted once.
+    '''
+    footprint = dict.fromkeys(('records', 'pointers', 'arrays', 'functions'), 0)
+    seen = set()
+    pending = list(ctypes_classes)
+    while pending:
+        ctype = pending.pop()
+        if ctype is None or ctype in seen:
+            continue
+        seen.add(ctype)
+        kind = _ctype_kind(ctype)
+        if kind is None:
+            continue
+
+        namespace = ctype.__dict__
+        size = sys.getsizeof(ctype) + sys.getsizeof(dict(namespace))
+        for (name, value) in namespace.items():
+            if isinstance(value, type):
+                pending.append(value)
+            elif name == '_fields_':
+                size += object_size(value)
+                pending.extend(field[1] for field in value)
+            elif name == '_argtypes_':
+                pending.extend(value)
+            elif name not in ('__module__', '__doc__'):
+                size += sys.getsizeof(value)
+        footprint[kind] += size
+    return footprint
+
+
+# Where compilers keep the headers they provide (stddef.h, stdarg.h...),
+# in order of preference. The directory above include is named after
+# the version of the compiler, for gcc the one above that after its target.
+_BUILTIN_INCLUDE_PATTERNS = (
+    '/usr/lib/clang/*/include',
+    '/usr/lib/llvm-*/lib/clang/*/include',
+    '/usr/local/lib/clang/*/include',
+    '/usr/lib/gcc/*/*/include',
+)
+
+# Target of the gcc directories that fit the running python
+_HOST_TARGET = sysconfig.get_config_var('MULTIARCH')
+
+
+def _version_numbers(version: str) -> typing.List[int]:
+    return [int(x) for x in re.findall(r'\d+', version)]
+
+
+def _include_directory_key(
+        path: str,
+        preference: int,
+        libclang_version: typing.List[int],
+) -> tuple:
+    (parent, version) = os.path.split(os.path.dirname(path))
+    version_numbers = _version_numbers(version)
+    is_clang = 'clang' in _BUILTIN_INCLUDE_PATTERNS[preference]
+    return (
+        # The headers of the loaded libclang fit it best
+        is_clang and bool(version_numbers) and
+        libclang_version[:len(version_numbers)] == version_numbers,
+        -preference,
+        not is_clang and os.path.basename(parent) == _HOST_TARGET,
+        version_numbers,
+    )
+
+
+@functools.cache
+def builtin_include_flags() -> typing.Tuple[str, ...]:
+    '''Clang arguments for the headers the compiler provides.
+
+    libclang looks for them in its resource directory, which some builds
+    don't have (e.g. the libclang wheel). For those, the directory of
+    an installed clang of the same version as libclang is used, or else
+    the newest directory of an installed clang or gcc. The directories
+    are found on the file system, without running a compiler.
+    '''
+    library = clang.cindex.conf.get_filename()
+    if os.path.isabs(library) and glob.glob(os.path.join(
+            os.path.dirname(library), 'clang', '*', 'include', 'stddef.h',
+    )):
+        return ()
+
+    match = re.search(
+        r'version (\d+(?:\.\d+)*)',
+        c_import.header_parser.clang_version(),
+    )
+    libclang_version = _version_numbers(match.group(1)) if match else []
+    found = [
+        (_include_directory_key(path, preference, libclang_version), path)
+        for (preference, pattern) in enumerate(_BUILTIN_INCLUDE_PATTERNS)
+        for path in glob.glob(pattern)
+        if os.path.exists(os.path.join(path, 'stddef.h'))
+    ]
+    if not found:
+        return ()
+    return ('-isystem', max(found)[1])
+
+
+def include_all_source(headers: typing.Sequence[pathlib.Path]) -> str:
+    # Common mistake
+    assert not isinstance(headers, str), 'headrs should be a list of paths, not a single path!'
+
+    return ''.join(f'#include <{header_file}>\n' for header_file in headers)
+
+
+def cpp_command_line(
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+) -> typing.List[str]:
+    '''The arguments of cpp, reading the source from stdin'''
+    (cpp_command, cpp_flags) = resolve_cpp(cpp_command, cpp_flags)
+
+    command = [cpp_command, '-']
+    if cpp_flags is not None:
+        command.append(cpp_flags)
+    return command
+
+
+def preprocess_headers(
+        headers: typing.Sequence[pathlib.Path],
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+):
+    return subprocess.run(
+        cpp_command_line(cpp_command, cpp_flags),
+        check=True,
+        encoding='utf-8',
+        input=include_all_source(headers),
+        stdout=subprocess.PIPE,
+    ).stdout
+
+
+async def preprocess_headers_async(
+        headers: typing.Sequence[pathlib.Path],
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+):
+    '''Like preprocess_headers, without blocking the event loop'''
+    command = cpp_command_line(cpp_command, cpp_flags)
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    (stdout, _) = await process.communicate(
+        include_all_source(headers).encode('utf-8')
+    )
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return stdout.decode('utf-8')
+
+
+def request_key(
+        headers: typing.Sequence[pathlib.Path],
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+        use_cpp: bool = True,
+        **extra
+) -> str:
+    '''Cache key of loading headers with the given pre-processor'''
+    (cpp_command, cpp_flags) = resolve_cpp(cpp_command, cpp_flags)
+    return c_import.cache.request_key(
+        headers=list(map(str, headers)),
+        cpp_command=cpp_command if use_cpp else None,
+        cpp_flags=cpp_flags,
+        clang_version=c_import.header_parser.clang_version(),
+        **extra
+    )
+
+
+def translate_headers(
+        headers: typing.Sequence[pathlib.Path],
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+        use_cpp: bool = True,
+        ast_cache_dir: typing.Optional[pathlib.Path] = None,
+        statistics: typing.Optional[LoadStatistics] = None,
+        preprocess: typing.Optional[typing.Callable[..., str]] = None,
+) -> typing.Tuple[clang.cindex.TranslationUnit, typing.Set[str]]:
+    '''Parse headers into a single translation unit.
+
+    Returns the translation unit and the files that were included.
+
+    When use_cpp is False, the headers are pre-processed by libclang
+    itself, and cpp_flags is split into clang arguments. The headers of
+    the compiler are added when libclang can't find them (see
+    builtin_include_flags). Without an installed clang or gcc, their
+    directory must be given in cpp_flags.
+
+    When ast_cache_dir is given, the translation unit is saved there,
+    and later calls with the same arguments load it instead of
+    pre-processing and parsing the headers again.
+
+    preprocess is called instead of preprocess_headers to run cpp.
+    '''
+    if statistics is None:
+        statistics = LoadStatistics()
+    if preprocess is None:
+        preprocess = preprocess_headers
+
+    ast_cache = None
+    if ast_cache_dir is not None:
+        with statistics.phase('ast_cache_load'):
+            ast_cache = c_import.header_parser.TranslationUnitCache(
+                ast_cache_dir
+            )
+            ast_key = request_key(
+                headers,
+                cpp_command,
+                cpp_flags,
+                use_cpp,
+                artifact='translation_unit',
+            )
+            cached = ast_cache.load(ast_key)
+        if cached is not None:
+            return cached
+
+    if use_cpp:
+        with statistics.phase('preprocess'):
+            preprocessed = preprocess(headers, cpp_command, cpp_flags)
+            dependencies = c_import.cache.included_files(preprocessed)
+        statistics.preprocessed_bytes = len(preprocessed.encode('utf-8'))
+        with statistics.phase('parse'):
+            translation_unit = \
+                c_import.header_parser.parse_source_translation_unit(
+                    preprocessed
+                )
+    else:
+        (_, cpp_flags) = resolve_cpp(cpp_command, cpp_flags)
+        with statistics.phase('parse'):
+            translation_unit = \
+                c_import.header_parser.parse_source_translation_unit(
+                    include_all_source(headers),
+                    [*shlex.split(cpp_flags or ''), *builtin_include_flags()],
+                )
+            dependencies = c_import.header_parser.included_files(
+                translation_unit
+            )
+
+    if ast_cache is not None:
+        with statistics.phase('ast_cache_store'):
+            ast_cache.store(ast_key, translation_unit, dependencies)
+
+    return (translation_unit, dependencies)
+
+
+def parse_headers(
+        headers: typing.Sequence[pathlib.Path],
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+        use_cpp: bool = True,
+        ast_cache_dir: typing.Optional[pathlib.Path] = None,
+        declaration_filter: typing.Optional[c_import.header_parser.DeclarationFilter] = None,
+        statistics: typing.Optional[LoadStatistics] = None,
+        preprocess: typing.Optional[typing.Callable[..., str]] = None,
+) -> typing.Tuple[c_import.header_parser.CInterface, typing.Set[str]]:
+    '''Create the interface of headers.
+
+    Returns the interface and the files that were included.
+    '''
+    if statistics is None:
+        statistics = LoadStatistics()
+
+    (translation_unit, dependencies) = translate_headers(
+        headers,
+        cpp_command,
+        cpp_flags,
+        use_cpp,
+        ast_cache_dir,
+        statistics,
+        preprocess,
+    )
+    statistics.parse = c_import.header_parser.ParseStatistics()
+    with statistics.phase('walk'):
+        interface = c_import.header_parser.interface_from_translation_unit(
+            translation_unit,
+            declaration_filter,
+            statistics.parse,
+        )
+    return (interface, dependencies)
+
+
+def _describe_headers(
+        arguments: typing.Tuple
+) -> typing.Tuple[dict, typing.Set[str]]:
+    (interface, dependencies) = parse_headers(*arguments)
+    return (
+        c_import.description.describe_interface(interface),
+        dependencies,
+    )
+
+
+def describe_headers_sharded(
+        headers: typing.Sequence[pathlib.Path],
+        shards: int,
+        cpp_command: typing.Optional[str] = None,
+        cpp_flags: typing.Optional[str] = None,
+        use_cpp: bool = True,
+        ast_cache_dir: typing.Optional[pathlib.Path] = None,
+        declaration_filter: typing.Optional[c_import.header_parser.DeclarationFilter] = None,
+) -> typing.Tuple[dict, typing.Set[str]]:
+    '''Describe the interface of headers using a pool of processes.
+
+    The headers are split into up to shards consecutive groups. Every
+    group is pre-processed and parsed on its own, so each header should
+    be usable without the ones before it.
+
+    Returns the merged description and the files that were included.
+    '''
+    assert shards > 0
+    group_size = -(-len(headers) // shards)
+    groups = [
+        list(headers[i:i + group_size])
+        for i in range(0, len(headers), group_size)
+    ]
+
+    with concurrent.futures.ProcessPoolExecutor(len(groups)) as executor:
+        results = list(executor.map(_describe_headers, [
+            (
+                group,
+                cpp_command,
+                cpp_flags,
+                use_cpp,
+                ast_cache_dir,
+                declaration_filter,
+            )
+            for group in groups
+        ]))
+
+    description = c_import.description.merge_descriptions(
+        x[0] for x in results
+    )
+    dependencies = set().union(*(x[1] for x in results))
+    return (description, dependencies)
+
 
 # TODO: Better name
 class CDLLX(ctypes.CDLL):
+    '''A CDLL that knows the types of its symbols.
+
+    With lazy=True, declarations are only indexed while loading. The
+    ctypes types of a name are created on its first access. The cache
+    stores complete interfaces, so a lazy load that misses the cache
+    handles every declaration anyway.
+
+    With shards=N, the headers are split into N groups that are parsed
+    by a pool of processes (see describe_headers_sharded).
+
+    When symbols or prefixes are given, only the declarations of those
+    names, or of names starting with one of the prefixes, are handled,
+    along with the types they reference.
+
+    Similarly, headers_only=True keeps only the declarations located in
+    the files headers resolved to, not in the files those include, and
+    locations keeps the ones located in files matching its
+    fnmatch patterns (e.g. '/opt/sdk/include/*').
+
+    The time spent in every phase of the load is recorded in
+    load_statistics. statistics_hooks, and the functions in
+    STATISTICS_HOOKS, are called with the CDLLX and its statistics when
+    the load is done.
+
+    The values of looked up names are cached, including function
+    objects and the views of globals, as are the names that are missing.
+
+    Symbols named like the methods of the library (reload, specialize,
+    aio, new_shared, memory_report, load_statistics and CDLL's own) are
+    hidden by them as attributes, and are looked up with lib['reload'].
+
+    Calls of the functions selected by fast_call, a collection of names
+    or a predicate on the name, keep holding the GIL. That saves
+    releasing and acquiring it around functions that return almost
+    immediately (abs, htons, isalpha...), but blocks every other thread
+    for the duration of the call.
+
+    With background=True, the headers are loaded by a thread, and the
+    first lookup waits for it to finish (see wait_loaded). preprocess replaces
+    preprocess_headers (see load_async).
+
+    With a type_registry (e.g. c_import.description.SHARED_TYPES), the
+    records are interned in it, so libraries loaded with the same
+    registry share the classes of identical records. It isn't used by
+    lazy loads that aren't cached.
+
+    Interfaces loaded from a cache or from shards keep the description
+    of their types, and only create the ctypes classes of the names that
+    are looked up. With compact=True, equal parts of the description
+    are shared (which slows down loading from the cache), and headers
+    that were parsed in process are described too (unless reloadable).
+    The classes created while parsing stay alive in ctypes' own caches,
+    so the savings are smaller there. See memory_report.
+
+    description (see c_import.description) is used instead of parsing
+    the headers. Pickled libraries are recreated by loading them from
+    cache_dir, or from their description when there's no cache_dir, so
+    worker processes don't parse the headers again. A process only
+    recreates every library once, with SHARED_TYPES as its registry so
+    that the pickled records it receives are of its own classes.
+    '''
+
     def __init__(
             self,
             library,
             headers: typing.Sequence[pathlib.Path],
             cpp_command: typing.Optional[str]=None,
-            cpp_flags: typing.Optional[str]=None
+            cpp_flags: typing.Optional[str]=None,
+            cache_dir: typing.Optional[pathlib.Path]=None,
+            use_cpp: bool=True,
+            lazy: bool=False,
+            ast_cache_dir: typing.Optional[pathlib.Path]=None,
+            shards: typing.Optional[int]=None,
+            symbols: typing.Optional[typing.Collection[str]]=None,
+            prefixes: typing.Optional[typing.Collection[str]]=None,
+            headers_only: bool=False,
+            locations: typing.Optional[typing.Collection[str]]=None,
+            statistics_hooks: typing.Iterable[typing.Callable[['CDLLX', LoadStatistics], None]]=(),
+            fast_call: typing.Union[typing.Collection[str], typing.Callable[[str], bool]]=(),
+            background: bool=False,
+            preprocess: typing.Optional[typing.Callable[..., str]]=None,
+            reloadable: bool=False,
+            type_registry: typing.Optional[c_import.description.TypeRegistry]=None,
+            compact: bool=False,
+            description: typing.Optional[dict]=None,
     ):
+        # Arguments that recreate the library in another process
+        self._load_arguments = dict(
+            library=library,
+            headers=headers,
+            cpp_command=cpp_command,
+            cpp_flags=cpp_flags,
+            cache_dir=cache_dir,
+            use_cpp=use_cpp,
+            lazy=lazy,
+            ast_cache_dir=ast_cache_dir,
+            shards=shards,
+            symbols=symbols,
+            prefixes=prefixes,
+            headers_only=headers_only,
+            locations=locations,
+            fast_call=fast_call,
+            reloadable=reloadable,
+            type_registry=type_registry,
+            compact=compact,
+        )
+
+        # Values of names that were already looked up, and missing names
+        self._resolved = {}
+        self._missing = set()
+        self._names = None
+        self._specialized = {}
+        self._aio = None
+        self._fast_call = fast_call if callable(fast_call) \
+            else frozenset(fast_call).__contains__
+        self._declarations = None
+        self._declarations_lock = threading.Lock()
+        self._load_statistics = LoadStatistics()
+        self._loaded = threading.Event()
+        self._load_error = None
         super().__init__(library)
-        with tempfile.NamedTemporaryFile(
-                mode='w',
-                encoding='utf-8',
-                suffix='.h'
-        ) as combined_header:
-            combined_header.write(preprocess_headers(
+
+        load = functools.partial(
+            self._load,
+            headers,
+            cpp_command,
+            cpp_flags,
+            cache_dir,
+            use_cpp,
+            lazy,
+            ast_cache_dir,
+            shards,
+            symbols,
+            prefixes,
+            headers_only,
+            locations,
+            preprocess,
+            reloadable,
+            type_registry,
+            compact,
+            description,
+        )
+        self._reload_all = load
+        hooks = (*STATISTICS_HOOKS, *statistics_hooks)
+        if background:
+            threading.Thread(
+                target=self._load_in_background,
+                args=(load, hooks),
+                name=f'c_import load of {self._name}',
+                daemon=True,
+            ).start()
+        else:
+            load()
+            self._loaded.set()
+            for hook in hooks:
+                hook(self, self._load_statistics)
+
+    def _load_in_background(self, load, hooks):
+        try:
+            load()
+        except BaseException as error:
+            self._load_error = error
+        finally:
+            self._loaded.set()
+
+        if self._load_error is None:
+            for hook in hooks:
+                hook(self, self._load_statistics)
+
+    def wait_loaded(self, timeout: typing.Optional[float]=None) -> bool:
+        '''Wait for a background load to finish.
+
+        Returns False on timeout, and raises the error the load failed
+        with, if any.
+        '''
+        if not self._loaded.wait(timeout):
+            return False
+        if self._load_error is not None:
+            raise self._load_error
+        return True
+
+    @property
+    def load_statistics(self) -> LoadStatistics:
+        return self._load_statistics
+
+    def _load(
+            self,
+            headers,
+            cpp_command,
+            cpp_flags,
+            cache_dir,
+            use_cpp,
+            lazy,
+            ast_cache_dir,
+            shards,
+            symbols,
+            prefixes,
+            headers_only,
+            locations,
+            preprocess,
+            reloadable,
+            type_registry,
+            compact,
+            description,
+    ):
+        statistics = self._load_statistics
+        self._declarations = None
+        self._translation_unit = None
+
+        if description is not None:
+            with statistics.phase('build'):
+                if compact:
+                    c_import.description.share_refs(description)
+                self._interface = c_import.description.build_interface(
+                    description,
+                    type_registry,
+                    lazy=True,
+                )
+            return
+
+        declaration_filter = None
+        if symbols is not None or prefixes is not None or \
+           locations is not None or headers_only:
+            declaration_filter = c_import.header_parser.DeclarationFilter(
+                names=frozenset(symbols) if symbols is not None else None,
+                prefixes=tuple(sorted(prefixes or ())),
+                locations=tuple(sorted(locations)) \
+                    if locations is not None else None,
+                headers_only=headers_only,
+            )
+
+        cache = None
+        if cache_dir is not None:
+            cache = c_import.cache.InterfaceCache(cache_dir)
+            cache_key = request_key(
+                headers,
+                cpp_command,
+                cpp_flags,
+                use_cpp,
+                declaration_filter=declaration_filter and [
+                    sorted(declaration_filter.names or ()),
+                    declaration_filter.names is None,
+                    declaration_filter.prefixes,
+                    declaration_filter.locations,
+                    declaration_filter.headers_only,
+                ],
+            )
+            with statistics.phase('cache_load'):
+                description = cache.load(cache_key)
+            if description is not None:
+                with statistics.phase('build'):
+                    if compact:
+                        c_import.description.share_refs(description)
+                    self._interface = c_import.description.build_interface(
+                        description,
+                        type_registry,
+                        lazy=True,
+                    )
+                return
+
+        if shards is not None:
+            with statistics.phase('shards'):
+                (description, dependencies) = describe_headers_sharded(
+                    headers,
+                    shards,
+                    cpp_command,
+                    cpp_flags,
+                    use_cpp,
+                    ast_cache_dir,
+                    declaration_filter,
+                )
+            with statistics.phase('build'):
+                if compact:
+                    c_import.description.share_refs(description)
+                self._interface = c_import.description.build_interface(
+                    description,
+                    type_registry,
+                    lazy=True,
+                )
+            if cache is not None:
+                with statistics.phase('cache_store'):
+                    cache.store(cache_key, dependencies, description)
+            return
+
+        (translation_unit, dependencies) = translate_headers(
+            headers,
+            cpp_command,
+            cpp_flags,
+            use_cpp,
+            ast_cache_dir,
+            statistics,
+            preprocess,
+        )
+        statistics.parse = c_import.header_parser.ParseStatistics()
+
+        if lazy and cache is None:
+            self._interface = c_import.header_parser.CInterface(
+                types={},
+                symbols={},
+                enum_consts={},
+                _statistics=statistics.parse,
+            )
+            with statistics.phase('index'):
+                self._declarations = \
+                    c_import.header_parser.index_translation_unit(
+                        translation_unit,
+                        declaration_filter,
+                    )
+        else:
+            with statistics.phase('walk'):
+                self._interface = \
+                    c_import.header_parser.interface_from_translation_unit(
+                        translation_unit,
+                        declaration_filter,
+                        statistics.parse,
+                    )
+
+        description = None
+        if (type_registry is not None or compact) and \
+           self._declarations is None:
+            with statistics.phase('rebuild'):
+                description = \
+                    c_import.description.describe_interface(self._interface)
+                if compact:
+                    c_import.description.share_refs(description)
+                # reload modifies the tables of the interface
+                self._interface = c_import.description.build_interface(
+                    description,
+                    type_registry,
+                    lazy=not reloadable,
+                )
+
+        if cache is not None:
+            with statistics.phase('cache_store'):
+                cache.store(
+                    cache_key,
+                    dependencies,
+                    description or
+                    c_import.description.describe_interface(self._interface),
+                )
+
+        if self._declarations is not None or reloadable:
+            self._translation_unit = translation_unit
+            self._declaration_filter = declaration_filter
+            self._dependencies = c_import.cache.digest_files(dependencies)
+            self._translate_arguments = (
                 headers,
                 cpp_command,
-                cpp_flags
-            ))
-            combined_header.flush()
-            self._interface = c_import.header_parser.parse_header(
-                pathlib.Path(combined_header.name)
+                cpp_flags,
+                use_cpp,
+                preprocess,
             )
 
+    def reload(self) -> typing.Set[str]:
+        '''Bring the library up to date with the files its headers include.
+
+        Reloading re-parses the headers, but only handles again the
+        declarations of files that changed, and the ones that refer to
+        them. Other types keep their ctypes classes. This requires the
+        translation unit of the load, which is kept with reloadable=True
+        or lazy=True. Otherwise the library is loaded from scratch.
+
+        Returns the names whose values may have changed.
+        '''
+        self.wait_loaded()
+        if self._translation_unit is None:
+            names = {*self._resolved, *self._interface_names()}
+            self._reload_all()
+            names.update(self._interface_names())
+            self._forget(names)
+            return names
+
+        changed_files = {
+            path
+            for (path, digest) in self._dependencies.items()
+            if not c_import.cache.files_unchanged({path: digest})
+        }
+        if not changed_files:
+            return set()
+
+        (headers, cpp_command, cpp_flags, use_cpp, preprocess) = \
+            self._translate_arguments
+        # Not TranslationUnit.reparse: it fails silently for translation
+        # units loaded from an AST file, the bindings ignore its result.
+        (translation_unit, dependencies) = translate_headers(
+            headers,
+            cpp_command,
+            cpp_flags,
+            use_cpp,
+            preprocess=preprocess,
+        )
+
+        index = c_import.header_parser.index_translation_unit(
+            translation_unit,
+            self._declaration_filter,
+        )
+        with self._declarations_lock:
+            names = c_import.header_parser.update_interface(
+                self._interface,
+                index,
+                handle=self._declarations is None,
+            )
+            if self._declarations is not None:
+                self._declarations = index
+        self._translation_unit = translation_unit
+        self._dependencies = c_import.cache.digest_files(dependencies)
+        self._forget(names)
+        return names
+
+    def _interface_names(self) -> typing.Set[str]:
+        interface = self._interface
+        return {*interface.symbols, *interface.enum_consts, *interface.types}
+
+    def _forget(self, names: typing.Collection[str]):
+        '''Drop the cached lookups of names'''
+        for name in names:
+            if name in self._resolved:
+                value = self._resolved.pop(name)
+                if self.__dict__.get(name) is value:
+                    del self.__dict__[name]
+        self._missing.clear()
+        self._names = None
+        for key in [x for x in self._specialized if x[0] in names]:
+            del self._specialized[key]
+        if self._aio is not None:
+            for name in names:
+                self._aio._functions.pop(name, None)
+
     def __getitem__(self, item):
+        try:
+            return self._resolved[item]
+        except KeyError:
+            pass
+
+        self.wait_loaded()
+        if item in self._missing:
+            raise KeyError(item)
+
+        value = self._resolve(item)
+        self._resolved[item] = value
+        return value
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+
+        try:
+            value = self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        self.wait_loaded()
+        if self._names is None:
+            tables = (self._declarations or self._interface)
+            self._names = [
+                name
+                for table in (
+                    tables.symbols,
+                    tables.enum_consts,
+                    tables.types,
+                )
+                for name in table
+                if name.isidentifier()
+            ]
+        return [*super().__dir__(), *self._names]
+
+    def __reduce__(self):
+        self.wait_loaded()
+        fast_call = self._load_arguments['fast_call']
+        if callable(fast_call):
+            try:
+                pickle.dumps(fast_call)
+            except (pickle.PicklingError, TypeError, AttributeError) as error:
+                raise pickle.PicklingError(
+                    'a library with a fast_call predicate can only be '
+                    'pickled when the predicate can (e.g. not a lambda)'
+                ) from error
+        description = None
+        if self._load_arguments['cache_dir'] is None:
+            if self._declarations is not None:
+                with self._declarations_lock:
+                    c_import.header_parser.handle_index(
+                        self._interface,
+                        self._declarations,
+                    )
+            description = \
+                c_import.description.describe_interface(self._interface)
+        return (_unpickle_library, (self._load_arguments, description))
+
+    def new_shared(
+            self,
+            name: str,
+            count: typing.Optional[int]=None,
+    ) -> c_import.shared.SharedObject:
+        '''A zeroed instance of a type in shared memory.
+
+        With count, an array of count instances. The handle of the
+        returned object can be pickled and attached to by other processes.
+            shared = libc.new_shared('tm', count=1000)
+            pool.submit(worker, shared.handle)
+        '''
+        ctype = self[name]
+        if not isinstance(ctype, type):
+            raise TypeError(f'{name} is not a type')
+        if count is not None:
+            ctype = ctype * count
+        return c_import.shared.SharedObject.create(ctype)
+
+    def memory_report(self) -> typing.Dict[str, int]:
+        '''Approximate bytes held by the library, by kind.
+
+        records, pointers, arrays and functions are the ctypes classes
+        that were created, descriptions the types that weren't created
+        yet, enum_consts and lookups the values of names. Classes that
+        are shared with other libraries are counted too, memory held by
+        libclang isn't.
+        '''
+        self.wait_loaded()
+        interface = self._interface
+        classes = [
+            ctype
+            for table in (interface.types, interface.symbols)
+            for ctype in (
+                table.built.values()
+                if isinstance(table, c_import.description.DescribedTable)
+                else table.values()
+            )
+        ]
+        classes.extend(type(value) for value in self._resolved.values())
+        report = ctypes_footprint(classes)
+        report['descriptions'] = object_size(
+            c_import.description.pending_description(interface)
+        )
+        report['enum_consts'] = object_size(interface.enum_consts)
+        report['lookups'] = object_size(self._resolved)
+        return report
+
+    @property
+    def aio(self) -> 'AsyncLibrary':
+        '''Awaitable calls run by the default executor of the event loop'''
+        if self._aio is None:
+            self._aio = AsyncLibrary(self)
+        return self._aio
+
+    def specialize(self, name: str, *argtypes: type):
+        '''A fixed-arity function object for a call of a variadic function.
+
+        argtypes are the types of the arguments passed in place of the
+        ellipsis. They go through C's default argument promotions, so
+        c_float is passed as c_double and integers smaller than int as
+        c_int. The function objects are cached per name and argtypes.
+
+        The call uses the calling convention of a non variadic function,
+        which matches the variadic one on common ABIs such as x86-64 and
+        i386, but not on Apple's arm64.
+        '''
+        key = (name, argtypes)
+        try:
+            return self._specialized[key]
+        except KeyError:
+            pass
+
+        self[name]
+        if name not in self._interface.variadic:
+            raise ValueError(f'{name} is not a variadic function')
+
+        prototype = self._prototype(name)
+        specialized = function_type(
+            prototype._flags_,
+            prototype._restype_,
+            *prototype._argtypes_,
+            *map(promote_argtype, argtypes),
+        )((name, self))
+        self._specialized[key] = specialized
+        return specialized
+
+    def _prototype(self, name: str) -> type:
+        prototype = self._interface.symbols[name]
+        if self._fast_call(name):
+            return function_type(
+                prototype._flags_ | ctypes._FUNCFLAG_PYTHONAPI,
+                prototype._restype_,
+                *prototype._argtypes_,
+            )
+        return prototype
+
+    def _resolve(self, item):
+        if self._declarations is not None:
+            with self._declarations_lock:
+                c_import.header_parser.handle_indexed_deceleration(
+                    self._interface,
+                    self._declarations,
+                    item,
+                )
+
         if item in self._interface.symbols:
             ctype = self._interface.symbols.get(item)
             if issubclass(ctype, ctypes._CFuncPtr):
-                return ctype((item, self))
+                return self._prototype(item)((item, self))
 
             return ctype.in_dll(self, item)
 
@@ -98,8 +1106,132 @@ class CDLLX(ctypes.CDLL):
         if item in self._interface.types:
             return self._interface.types.get(item)
 
-        raise KeyError
+        self._missing.add(item)
+        raise KeyError(item)
+
+
+# Libraries that were unpickled by this process, by their request_key
+_unpickled_libraries: typing.Dict[str, CDLLX] = {}
+_unpickled_libraries_lock = threading.Lock()
+
+
+def _unpickle_library(arguments: dict, description: typing.Optional[dict]) -> CDLLX:
+    # Unpickled classes are interned in SHARED_TYPES, the records of the
+    # library must be the same classes to be passed to its functions.
+    arguments = dict(
+        arguments,
+        type_registry=c_import.description.SHARED_TYPES,
+    )
+    key = c_import.cache.request_key(
+        arguments=dict(arguments, type_registry=None),
+        description=description,
+    )
+    with _unpickled_libraries_lock:
+        if key not in _unpickled_libraries:
+            _unpickled_libraries[key] = CDLLX(
+                **arguments,
+                description=description,
+            )
+        return _unpickled_libraries[key]
+
+
+class AsyncLibrary:
+    '''Awaitable versions of the functions of a library.
+
+    Every call runs in executor (the default executor of the running
+    event loop when None), using the function objects of the library.
+        await AsyncLibrary(libc, pool).fwrite(buffer, 1, len(buffer), f)
+
+    The executor keeps the arguments alive until the call returns, even
+    if the awaiting task is cancelled in the meantime.
+    '''
+
+    def __init__(
+            self,
+            library: CDLLX,
+            executor: typing.Optional[concurrent.futures.Executor] = None,
+    ):
+        self._library = library
+        self._executor = executor
+        self._functions = {}
+
+    def __getitem__(self, name: str):
+        try:
+            return self._functions[name]
+        except KeyError:
+            pass
+
+        function = self._library[name]
+        if not isinstance(function, ctypes._CFuncPtr):
+            raise TypeError(f'{name} is not a function')
+
+        executor = self._executor
+        async def call(*args):
+            return await asyncio.get_running_loop().run_in_executor(
+                executor,
+                function,
+                *args,
+            )
+        call.__name__ = call.__qualname__ = name
+        self._functions[name] = call
+        return call
+
+    def __getattr__(self, name: str):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
 
 def load(*args, **kwargs) -> CDLLX:
     return CDLLX(*args, **kwargs)
+
+
+async def load_async(
+        *args,
+        executor: typing.Optional[concurrent.futures.Executor] = None,
+        **kwargs
+) -> CDLLX:
+    '''Load a library without blocking the event loop.
+
+    cpp runs as an asyncio subprocess, everything else runs in executor
+    (the default executor of the loop when None).
+    '''
+    loop = asyncio.get_running_loop()
+
+    def preprocess(headers, cpp_command, cpp_flags):
+        return asyncio.run_coroutine_threadsafe(
+            preprocess_headers_async(headers, cpp_command, cpp_flags),
+            loop,
+        ).result()
+
+    return await loop.run_in_executor(
+        executor,
+        functools.partial(load, *args, preprocess=preprocess, **kwargs),
+    )
+
+
+LoadSpec = typing.Union[typing.Mapping[str, typing.Any], typing.Sequence]
+
+def load_many(
+        specs: typing.Iterable[LoadSpec],
+        max_workers: typing.Optional[int] = None
+) -> typing.List[CDLLX]:
+    '''Load several libraries concurrently.
+
+    Every spec is either the positional arguments of load, or a mapping
+    of its keyword arguments. The results are in the order of specs.
+
+    cpp runs in a child process and libclang releases the GIL,
+    so the libraries are loaded in threads.
+    '''
+    def load_spec(spec: LoadSpec) -> CDLLX:
+        if isinstance(spec, typing.Mapping):
+            return load(**spec)
+        return load(*spec)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(load_spec, specs))
@@ -0,0 +1,126 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''NumPy views of ctypes objects.
+
+Requires numpy (pip install c_import[numpy]).
+
+dtype converts interface types into structured dtypes that match their
+ctypes layout, so arrays of C records can be processed with vectorized
+operations instead of attribute access on every record:
+    tms = c_import.ndarray.from_pointer(records, count)
+    tms['tm_year'].mean()
+
+The views share memory with the C objects, which must outlive them.
+'''
+
+import ctypes
+import typing
+
+import numpy
+
+
+# Scalar ctypes that numpy doesn't understand or converts differently
+_SCALAR_DTYPES = {
+    ctypes.c_char_p: numpy.dtype(numpy.uintp),
+    ctypes.c_wchar_p: numpy.dtype(numpy.uintp),
+    ctypes.c_void_p: numpy.dtype(numpy.uintp),
+    ctypes.c_wchar: numpy.dtype('U1') if ctypes.sizeof(ctypes.c_wchar) == 4
+    else numpy.dtype(numpy.uint16),
+}
+
+
+def _record_fields(
+        ctype: type,
+        base_offset: int,
+) -> typing.Iterator[typing.Tuple[str, numpy.dtype, int]]:
+    '''(name, dtype, offset) of the fields of a record.
+
+    Members of anonymous fields are flattened into the record, like
+    ctypes does. Bit fields have no dtype and are skipped.
+    '''
+    anonymous = getattr(ctype, '_anonymous_', ())
+    for field in ctype._fields_:
+        if len(field) == 3:
+            continue
+        (name, field_type) = field[:2]
+        offset = base_offset + getattr(ctype, name).offset
+        if name in anonymous:
+            yield from _record_fields(field_type, offset)
+        else:
+            yield (name, dtype(field_type), offset)
+
+
+def dtype(ctype: type) -> numpy.dtype:
+    '''The numpy dtype of a ctypes type.
+
+    Records become structured dtypes with the offsets and size ctypes
+    computed (so _pack_ and unions are honored), arrays become subarray
+    dtypes and pointers become uintp addresses.
+    '''
+    if ctype in _SCALAR_DTYPES:
+        return _SCALAR_DTYPES[ctype]
+
+    if issubclass(ctype, (ctypes._Pointer, ctypes._CFuncPtr)):
+        return numpy.dtype(numpy.uintp)
+
+    if issubclass(ctype, ctypes.Array):
+        element = dtype(ctype._type_)
+        return numpy.dtype((element.base, (ctype._length_, *element.shape)))
+
+    if issubclass(ctype, (ctypes.Structure, ctypes.Union)):
+        if not hasattr(ctype, '_fields_'):
+            raise TypeError(f'{ctype.__name__} is incomplete')
+
+        fields = list(_record_fields(ctype, 0))
+        return numpy.dtype({
+            'names': [x[0] for x in fields],
+            'formats': [x[1] for x in fields],
+            'offsets': [x[2] for x in fields],
+            'itemsize': ctypes.sizeof(ctype),
+        })
+
+    return numpy.dtype(ctype)
+
+
+def _view(address: int, ctype: type, length: int) -> numpy.ndarray:
+    buffer = (ctypes.c_char * (ctypes.sizeof(ctype) * length)).from_address(
+        address
+    )
+    return numpy.frombuffer(buffer, dtype=dtype(ctype), count=length)
+
+
+def from_pointer(pointer: ctypes._Pointer, length: int) -> numpy.ndarray:
+    '''A view of length elements starting at pointer'''
+    address = ctypes.cast(pointer, ctypes.c_void_p).value
+    if address is None:
+        raise ValueError('NULL pointer')
+    return _view(address, pointer._type_, length)
+
+
+def view(cdata: typing.Any) -> numpy.ndarray:
+    '''A view of a ctypes array or record, e.g. an exported global array.
+
+    Records become 0 dimensional arrays.
+    '''
+    ctype = type(cdata)
+    if issubclass(ctype, ctypes.Array):
+        return _view(ctypes.addressof(cdata), ctype._type_, ctype._length_)
+
+    return _view(ctypes.addressof(cdata), ctype, 1).reshape(())
@@ -0,0 +1,108 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''ctypes objects in shared memory.
+
+The objects are created with from_buffer over a
+multiprocessing.shared_memory block, so every process that attaches to
+the block sees (and modifies) the same records without copying them.
+Pointers stored in shared records are only meaningful in the process
+that set them.
+'''
+
+import ctypes
+import dataclasses
+import sys
+from multiprocessing import shared_memory
+
+
+class _SharedMemory(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            # ctypes objects still use the mapping, it's unmapped with
+            # the last of them.
+            self._mmap = None
+            super().close()
+
+
+def _attach_memory(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return _SharedMemory(name, track=False)
+
+    # Before 3.13, attaching registers the block with the resource
+    # tracker of the process, which unlinks it when the process exits.
+    # Children share the tracker of their parent, so this only matters
+    # for unrelated processes.
+    return _SharedMemory(name)
+
+
+@dataclasses.dataclass(frozen=True)
+class SharedHandle:
+    '''Picklable reference to a ctypes object in shared memory'''
+
+    # Name of the shared memory block
+    name: str
+
+    # Type of the object, pickled by its description. Other processes
+    # get the classes of the libraries they unpickle (see SHARED_TYPES).
+    ctype: type
+
+    def attach(self) -> 'SharedObject':
+        return SharedObject(_attach_memory(self.name), self.ctype)
+
+
+class SharedObject:
+    '''A ctypes object in a shared memory block.
+
+    value is the object and handle attaches other processes to it. The
+    block stays mapped as long as value or one of its elements is
+    referenced, even after close. The process that created the block
+    should unlink it once every process is done with it.
+    '''
+
+    def __init__(self, memory: shared_memory.SharedMemory, ctype: type):
+        self.memory = memory
+        self.handle = SharedHandle(memory.name, ctype)
+        self.value = ctype.from_buffer(memory.buf)
+
+    @classmethod
+    def create(cls, ctype: type) -> 'SharedObject':
+        '''A zeroed ctype instance in a new shared memory block'''
+        memory = _SharedMemory(
+            create=True,
+            size=max(ctypes.sizeof(ctype), 1),
+        )
+        return cls(memory, ctype)
+
+    def close(self):
+        '''Detach this process from the block'''
+        self.value = None
+        self.memory.close()
+
+    def unlink(self):
+        '''Free the block once every process closed it'''
+        self.memory.unlink()
+
+    def __enter__(self) -> 'SharedObject':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -26,4 +26,7 @@ setup(
     install_requires=[
         'clang',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
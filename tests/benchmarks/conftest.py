@@ -0,0 +1,120 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Benchmarks, in the style of pytest-benchmark.
+
+With pytest-benchmark installed, its benchmark fixture and options are
+used (e.g. --benchmark-only, --benchmark-compare). Otherwise a minimal
+fallback times every benchmark and prints the results at the end of
+the session, so the benchmarks also run offline.
+'''
+
+import time
+import typing
+
+import pytest
+
+try:
+    import pytest_benchmark
+except ImportError:
+    pytest_benchmark = None
+
+
+if pytest_benchmark is None:
+    # Seconds to spend measuring every benchmark
+    MEASURE_SECONDS = 0.1
+
+    _RESULTS: typing.List[typing.Tuple[str, str, float, int, dict]] = []
+
+    class _Benchmark:
+        def __init__(self, name: str, group: typing.Optional[str]):
+            self.name = name
+            self.group = group or ''
+            self.extra_info = {}
+
+        def _report(self, mean: float, rounds: int):
+            _RESULTS.append(
+                (self.group, self.name, mean, rounds, self.extra_info)
+            )
+
+        def __call__(self, function, *args, **kwargs):
+            result = function(*args, **kwargs)
+
+            rounds = 0
+            batch = 1
+            start = time.perf_counter()
+            while True:
+                for _ in range(batch):
+                    function(*args, **kwargs)
+                rounds += batch
+                elapsed = time.perf_counter() - start
+                if elapsed >= MEASURE_SECONDS:
+                    break
+                batch *= 2
+
+            self._report(elapsed / rounds, rounds)
+            return result
+
+        def pedantic(
+                self,
+                function,
+                args=(),
+                kwargs=None,
+                setup=None,
+                rounds=1,
+                iterations=1,
+        ):
+            elapsed = 0.0
+            for _ in range(rounds):
+                if setup is not None:
+                    setup()
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    result = function(*args, **(kwargs or {}))
+                elapsed += time.perf_counter() - start
+
+            self._report(elapsed / (rounds * iterations), rounds * iterations)
+            return result
+
+    def pytest_configure(config):
+        config.addinivalue_line(
+            'markers',
+            'benchmark(group): group of the benchmark in the report',
+        )
+
+    @pytest.fixture
+    def benchmark(request):
+        marker = request.node.get_closest_marker('benchmark')
+        group = marker.kwargs.get('group') if marker is not None else None
+        return _Benchmark(request.node.name, group)
+
+    def pytest_terminal_summary(terminalreporter):
+        if not _RESULTS:
+            return
+        terminalreporter.section('benchmarks')
+        width = max(len(x[1]) for x in _RESULTS)
+        for (group, name, mean, rounds, extra_info) in sorted(
+                _RESULTS,
+                key=lambda x: x[:2],
+        ):
+            extra = ''.join(f'  {k}={v}' for (k, v) in extra_info.items())
+            terminalreporter.write_line(
+                f'{group:<12} {name:<{width}} '
+                f'{mean * 1e9:14.1f} ns  ({rounds} rounds){extra}'
+            )
@@ -0,0 +1,130 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Generate synthetic headers of a configurable size.'''
+
+import dataclasses
+import typing
+
+
+@dataclasses.dataclass
+class HeaderShape:
+    structs: int = 100
+    unions: int = 20        # Structs with nested anonymous unions
+    union_depth: int = 2
+    bitfields: int = 20     # Structs with bitfields
+    typedef_chains: int = 20
+    typedef_depth: int = 5
+    functions: int = 200
+    enums: int = 20
+    enum_values: int = 10
+
+    def scaled(self, factor: int) -> 'HeaderShape':
+        '''Multiply the number of every kind of declaration by factor'''
+        return dataclasses.replace(self, **{
+            name: getattr(self, name) * factor for name in _COUNTS
+        })
+
+    @property
+    def declarations(self) -> int:
+        return (
+            self.structs
+            + self.unions
+            + self.bitfields
+            + self.typedef_chains * self.typedef_depth
+            + self.functions
+            + self.enums
+        )
+
+
+_COUNTS = (
+    'structs',
+    'unions',
+    'bitfields',
+    'typedef_chains',
+    'functions',
+    'enums',
+)
+
+_SCALARS = ('int', 'unsigned long', 'double', 'char', 'short', 'float')
+
+_GROUP = 16
+
+
+def header_lines(shape: HeaderShape) -> typing.Iterator[str]:
+    # Structs reference each other in groups of _GROUP. ctypes includes
+    # the format of the pointed to struct in the format of a pointer, so
+    # a single chain of N structs costs O(N^2) time and memory in ctypes.
+    for i in range(shape.structs):
+        yield f'struct s{i} {{'
+        yield f'    {_SCALARS[i % len(_SCALARS)]} a;'
+        yield f'    char name[{i % 16 + 1}];'
+        if i % _GROUP > 0:
+            yield f'    struct s{i - 1} *prev;'
+        if i % _GROUP > 1:
+            yield f'    struct s{i - i % _GROUP} head;'
+        yield '};'
+
+    for i in range(shape.unions):
+        yield f'struct u{i} {{'
+        yield '    int kind;'
+        for depth in range(shape.union_depth):
+            yield '    union {'
+            yield f'        long l{depth};'
+            yield f'        struct {{ short x, y; }} point{depth}[{i % 4 + 1}];'
+            yield '        struct {'
+            yield f'        double d{depth};'
+        yield '    ' + '}; };' * shape.union_depth
+        yield '};'
+
+    for i in range(shape.bitfields):
+        yield f'struct b{i} {{'
+        yield f'    unsigned int f0 : {i % 7 + 1};'
+        yield '    unsigned int f1 : 3;'
+        yield '    int signed_field : 4;'
+        yield '    unsigned long wide;'
+        yield '};'
+
+    for i in range(shape.typedef_chains):
+        base = f'struct s{i % shape.structs}' if shape.structs else 'int'
+        yield f'typedef {base} t{i}_0;'
+        for depth in range(1, shape.typedef_depth):
+            yield f'typedef t{i}_{depth - 1} t{i}_{depth};'
+
+    for i in range(shape.enums):
+        values = ', '.join(
+            f'E{i}_{j} = {j * 3}' for j in range(shape.enum_values)
+        )
+        yield f'enum e{i} {{ {values} }};'
+
+    for i in range(shape.functions):
+        arguments = ['int']
+        if shape.structs:
+            arguments.append(f'struct s{i % shape.structs} *')
+        if shape.enums:
+            arguments.append(f'enum e{i % shape.enums}')
+        if shape.typedef_chains:
+            chain = i % shape.typedef_chains
+            arguments.append(f't{chain}_{shape.typedef_depth - 1} *')
+        returns = _SCALARS[i % len(_SCALARS)]
+        yield f'{returns} f{i}({", ".join(arguments)});'
+
+
+def header_source(shape: HeaderShape) -> str:
+    return '\n'.join(x for x in header_lines(shape) if x) + '\n'
@@ -0,0 +1,192 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Runtime overhead of c_import compared to ctypes.
+
+Every call is benchmarked through a CDLLX, through a CDLL with
+hand-written argtypes and restype, and through a plain CDLL.
+'''
+
+import ctypes
+
+import c_import
+import pytest
+
+
+class div_t(ctypes.Structure):
+    _fields_ = [('quot', ctypes.c_int), ('rem', ctypes.c_int)]
+
+
+@pytest.fixture(scope='module')
+def cdllx():
+    return c_import.loader.load(
+        'libc.so.6',
+        ['stdio.h', 'stdlib.h', 'string.h', 'errno.h'],
+    )
+
+
+@pytest.fixture(scope='module')
+def annotated():
+    libc = ctypes.CDLL('libc.so.6')
+    libc.abs.argtypes = [ctypes.c_int]
+    libc.abs.restype = ctypes.c_int
+    libc.strlen.argtypes = [ctypes.c_char_p]
+    libc.strlen.restype = ctypes.c_size_t
+    libc.div.argtypes = [ctypes.c_int, ctypes.c_int]
+    libc.div.restype = div_t
+    return libc
+
+
+@pytest.fixture(scope='module')
+def plain():
+    return ctypes.CDLL('libc.so.6')
+
+
+@pytest.mark.benchmark(group='lookup')
+def test_getitem_function(benchmark, cdllx):
+    benchmark(cdllx.__getitem__, 'abs')
+
+
+@pytest.mark.benchmark(group='lookup')
+def test_getitem_type(benchmark, cdllx):
+    benchmark(cdllx.__getitem__, 'div_t')
+
+
+@pytest.mark.benchmark(group='lookup')
+def test_getitem_enum_const(benchmark):
+    lib = c_import.loader.load('libc.so.6', ['errno.h', 'fenv.h'])
+    benchmark(lib.__getitem__, 'FE_TONEAREST')
+
+
+@pytest.mark.benchmark(group='lookup')
+def test_getattr_cached(benchmark, cdllx):
+    benchmark(getattr, cdllx, 'abs')
+
+
+@pytest.mark.benchmark(group='lookup')
+def test_getattr_plain(benchmark, plain):
+    benchmark(getattr, plain, 'abs')
+
+
+@pytest.mark.benchmark(group='global')
+def test_global_cdllx(benchmark, cdllx):
+    assert benchmark(cdllx.__getitem__, 'stdout')
+
+
+@pytest.mark.benchmark(group='global')
+def test_global_in_dll(benchmark, plain):
+    pointer = ctypes.c_void_p
+    assert benchmark(pointer.in_dll, plain, 'stdout')
+
+
+@pytest.mark.benchmark(group='call')
+def test_abs_cdllx(benchmark, cdllx):
+    abs_ = cdllx.abs
+    assert benchmark(abs_, -3) == 3
+
+
+@pytest.mark.benchmark(group='call')
+def test_abs_annotated(benchmark, annotated):
+    abs_ = annotated.abs
+    assert benchmark(abs_, -3) == 3
+
+
+@pytest.mark.benchmark(group='call')
+def test_abs_plain(benchmark, plain):
+    abs_ = plain.abs
+    assert benchmark(abs_, -3) == 3
+
+
+@pytest.mark.benchmark(group='call')
+def test_strlen_cdllx(benchmark, cdllx):
+    strlen = cdllx.strlen
+    assert benchmark(strlen, b'hello') == 5
+
+
+@pytest.mark.benchmark(group='call')
+def test_strlen_annotated(benchmark, annotated):
+    strlen = annotated.strlen
+    assert benchmark(strlen, b'hello') == 5
+
+
+@pytest.mark.benchmark(group='call')
+def test_strlen_plain(benchmark, plain):
+    strlen = plain.strlen
+    assert benchmark(strlen, b'hello') == 5
+
+
+@pytest.mark.benchmark(group='call')
+def test_div_cdllx(benchmark, cdllx):
+    div = cdllx.div
+    assert benchmark(div, 34, 4).rem == 2
+
+
+@pytest.mark.benchmark(group='call')
+def test_div_annotated(benchmark, annotated):
+    div = annotated.div
+    assert benchmark(div, 34, 4).rem == 2
+
+
+@pytest.mark.benchmark(group='call')
+def test_div_lookup_and_call_cdllx(benchmark, cdllx):
+    assert benchmark(lambda: cdllx['div'](34, 4)).rem == 2
+
+
+@pytest.mark.benchmark(group='variadic')
+def test_snprintf_guessed(benchmark, cdllx):
+    buffer = ctypes.create_string_buffer(64)
+    snprintf = cdllx.snprintf
+    benchmark(snprintf, buffer, 64, b'%d %f', 12, ctypes.c_double(3.5))
+
+
+@pytest.mark.benchmark(group='variadic')
+def test_snprintf_specialized(benchmark, cdllx):
+    buffer = ctypes.create_string_buffer(64)
+    snprintf = cdllx.specialize('snprintf', ctypes.c_int, ctypes.c_double)
+    benchmark(snprintf, buffer, 64, b'%d %f', 12, 3.5)
+
+
+FAST_CALL_HEADERS = ['stdlib.h', 'ctype.h', 'arpa/inet.h']
+FAST_CALL_ARGUMENTS = {'abs': (-3,), 'htons': (1,), 'isalpha': (65,)}
+
+
+@pytest.fixture(scope='module')
+def fast_call():
+    return c_import.loader.load(
+        'libc.so.6',
+        FAST_CALL_HEADERS,
+        fast_call=FAST_CALL_ARGUMENTS,
+    )
+
+
+@pytest.fixture(scope='module')
+def releases_gil():
+    return c_import.loader.load('libc.so.6', FAST_CALL_HEADERS)
+
+
+@pytest.mark.benchmark(group='fast_call')
+@pytest.mark.parametrize('name', FAST_CALL_ARGUMENTS)
+def test_fast_call(benchmark, fast_call, name):
+    benchmark(fast_call[name], *FAST_CALL_ARGUMENTS[name])
+
+
+@pytest.mark.benchmark(group='fast_call')
+@pytest.mark.parametrize('name', FAST_CALL_ARGUMENTS)
+def test_releases_gil(benchmark, releases_gil, name):
+    benchmark(releases_gil[name], *FAST_CALL_ARGUMENTS[name])
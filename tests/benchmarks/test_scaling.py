@@ -0,0 +1,76 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+'''Time and peak memory of parse_header against the size of the header.
+
+The default sizes are small. Set C_IMPORT_BENCHMARK_SCALES to a comma
+separated list of factors to measure larger headers, e.g. 1,10,100,500
+for about 500 to 230000 declarations.
+'''
+
+import os
+import tracemalloc
+
+import c_import
+import pytest
+
+import synthetic
+
+
+SCALES = [
+    int(x)
+    for x in os.environ.get('C_IMPORT_BENCHMARK_SCALES', '1,4').split(',')
+]
+
+
+@pytest.mark.benchmark(group='scaling')
+@pytest.mark.parametrize('scale', SCALES)
+def test_parse_header_scaling(benchmark, tmp_path, scale):
+    shape = synthetic.HeaderShape().scaled(scale)
+    header = tmp_path / 'synthetic.h'
+    header.write_text(synthetic.header_source(shape))
+
+    interface = benchmark.pedantic(
+        c_import.header_parser.parse_header,
+        (header,),
+        rounds=1,
+    )
+
+    # Measured separately, tracemalloc slows the parse down
+    tracemalloc.start()
+    try:
+        c_import.header_parser.parse_header(header)
+        (_, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    benchmark.extra_info['declarations'] = shape.declarations
+    benchmark.extra_info['peak_python_bytes'] = peak
+
+    assert len(interface.symbols) == shape.functions
+    assert len(interface.enum_consts) == shape.enums * shape.enum_values
+    # Anonymous records are also in types, under generated names
+    named_types = [x for x in interface.types if x.isidentifier()]
+    assert len(named_types) == (
+        shape.structs
+        + shape.unions
+        + shape.bitfields
+        + shape.typedef_chains * shape.typedef_depth
+        + shape.enums
+    )
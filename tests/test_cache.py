@@ -0,0 +1,228 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import ctypes
+import json
+import multiprocessing
+
+import c_import
+import pytest
+
+from test_header_parser import test_header_cases, types_are_equivalent
+
+
+@pytest.mark.parametrize(
+    'header_content,expected_types,expected_symbols,expected_enum_consts',
+    test_header_cases[0],
+    ids=test_header_cases[1])
+def test_description_round_trip(tmpdir,
+                                header_content: str,
+                                expected_types,
+                                expected_symbols,
+                                expected_enum_consts,
+):
+    header = tmpdir / 'header.h'
+    header.write(header_content)
+    description = c_import.description.describe_interface(
+        c_import.header_parser.parse_header(header)
+    )
+    interface = c_import.description.build_interface(
+        json.loads(json.dumps(description))
+    )
+
+    assert set(interface.types.keys()) == set(expected_types.keys())
+    for (key, value) in interface.types.items():
+        assert types_are_equivalent(value, expected_types[key])
+
+    assert set(interface.symbols.keys()) == set(expected_symbols.keys())
+    for (key, value) in interface.symbols.items():
+        assert types_are_equivalent(value, expected_symbols[key])
+
+    assert interface.enum_consts == expected_enum_consts
+
+
+def test_description_nested_anonymous_types(tmpdir):
+    header_content = '''
+struct node {
+    struct node *next;
+    union {
+        int x;
+        float y;
+    };
+    struct {
+        char a;
+        int b[3];
+    } inner[2];
+    unsigned int flag : 1;
+};
+'''
+    header = tmpdir / 'header.h'
+    header.write(header_content)
+    original = c_import.header_parser.parse_header(header).types['node']
+    rebuilt = c_import.description.build_interface(
+        c_import.description.describe_interface(
+            c_import.header_parser.parse_header(header)
+        )
+    ).types['node']
+
+    assert rebuilt is not original
+    assert ctypes.sizeof(rebuilt) == ctypes.sizeof(original)
+    assert rebuilt._fields_[0][1]._type_ is rebuilt
+    assert rebuilt._anonymous_ == original._anonymous_
+    instance = rebuilt(x=3)
+    instance.inner[1].b[2] = 7
+    assert instance.x == 3
+    assert instance.inner[1].b[2] == 7
+
+
+def test_cached_load(tmp_path, monkeypatch):
+    header = tmp_path / 'header.h'
+    header.write_text('''
+#include <stdlib.h>
+typedef struct { int a; } local_t;
+''')
+    def load():
+        return c_import.loader.load(
+            'libc.so.6',
+            ['header.h'],
+            cpp_flags=f'-I{tmp_path}',
+            cache_dir=tmp_path / 'cache',
+        )
+
+    cold = load()
+    assert cold.abs(-4) == 4
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+
+    # A warm cache shouldn't parse anything
+    def fail(*args, **kwargs):
+        raise AssertionError('parsed on a warm cache')
+    with monkeypatch.context() as m:
+        m.setattr(
+            c_import.header_parser,
+            'interface_from_translation_unit',
+            fail,
+        )
+        warm = load()
+    assert warm.abs(-4) == 4
+    assert warm.div(34, 4).rem == 2
+    assert warm['local_t']._fields_ == [('a', ctypes.c_int)]
+
+    # Changing an included file invalidates the entry
+    header.write_text('''
+#include <stdlib.h>
+typedef struct { long b; } local_t;
+''')
+    assert load()['local_t']._fields_ == [('b', ctypes.c_long)]
+
+
+def _load_in_process(args):
+    (tmp_path, index) = args
+    lib = c_import.loader.load(
+        'libc.so.6',
+        ['stdlib.h', 'stdio.h'],
+        cache_dir=tmp_path,
+    )
+    return lib.abs(-index)
+
+
+def test_concurrent_cache_fill(tmp_path):
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        results = pool.map(
+            _load_in_process,
+            [(tmp_path, i) for i in range(8)]
+        )
+    assert results == list(range(8))
+    assert [x.suffix for x in tmp_path.iterdir()] == ['.json']
+
+
+def test_ast_cache(tmp_path, monkeypatch):
+    header = tmp_path / 'header.h'
+    header.write_text('struct s { int a; }; int foo(struct s);')
+    ast_cache_dir = tmp_path / 'ast'
+
+    cold = c_import.header_parser.parse_header(header, ast_cache_dir)
+    assert cold.types['s']._fields_ == [('a', ctypes.c_int)]
+    assert len(list(ast_cache_dir.glob('*.ast'))) == 1
+
+    # A warm cache shouldn't invoke the clang front-end
+    def fail(*args, **kwargs):
+        raise AssertionError('parsed on a warm cache')
+    with monkeypatch.context() as m:
+        m.setattr(c_import.header_parser.clang.cindex.Index, 'parse', fail)
+        warm = c_import.header_parser.parse_header(header, ast_cache_dir)
+    assert warm.types['s']._fields_ == [('a', ctypes.c_int)]
+    assert 'foo' in warm.symbols
+
+    # Left behind by a writer that lost the race to replace the manifest
+    (manifest,) = ast_cache_dir.glob('*.ast.json')
+    key = manifest.name.removesuffix('.ast.json')
+    (ast_cache_dir / f'{key}.{"0" * 32}.ast').write_bytes(b'')
+
+    # Editing the header replaces the stale AST
+    header.write_text('struct s { double b; };')
+    changed = c_import.header_parser.parse_header(header, ast_cache_dir)
+    assert changed.types['s']._fields_ == [('b', ctypes.c_double)]
+    assert len(list(ast_cache_dir.glob('*.ast'))) == 1
+
+
+def test_loader_ast_cache(tmp_path, monkeypatch):
+    def load():
+        return c_import.loader.load(
+            'libc.so.6',
+            ['stdlib.h'],
+            ast_cache_dir=tmp_path,
+        )
+
+    assert load().abs(-2) == 2
+
+    def fail(*args, **kwargs):
+        raise AssertionError('pre-processed on a warm cache')
+    with monkeypatch.context() as m:
+        m.setattr(c_import.loader, 'preprocess_headers', fail)
+        warm = load()
+    assert warm.div(34, 4).quot == 8
+
+
+def test_record_fingerprint(tmp_path):
+    header = tmp_path / 'header.h'
+
+    def describe(content):
+        header.write_text(content)
+        description = c_import.description.describe_interface(
+            c_import.header_parser.parse_header(header)
+        )
+        return {
+            record['name']: c_import.description.record_fingerprint(
+                description['records'],
+                index,
+            )
+            for (index, record) in enumerate(description['records'])
+        }
+
+    original = describe('struct a { int x; }; struct b { struct a *p; };')
+    shifted = describe(
+        'struct c { char z; }; struct a { int x; }; struct b { struct a *p; };'
+    )
+    assert original['a'] == shifted['a']
+    assert original['b'] == shifted['b']
+
+    # Records that point to a changed record change too
+    changed = describe('struct a { long x; }; struct b { struct a *p; };')
+    assert original['a'] != changed['a']
+    assert original['b'] != changed['b']
@@ -0,0 +1,96 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import os
+import subprocess
+import sys
+
+import c_import
+import pytest
+
+from test_header_parser import test_header_cases, types_are_equivalent
+
+
+@pytest.mark.parametrize(
+    'header_content,expected_types,expected_symbols,expected_enum_consts',
+    test_header_cases[0],
+    ids=test_header_cases[1])
+def test_generated_module(tmpdir,
+                          header_content: str,
+                          expected_types,
+                          expected_symbols,
+                          expected_enum_consts,
+):
+    header = tmpdir / 'header.h'
+    header.write(header_content)
+    source = c_import.generator.generate_module(
+        c_import.header_parser.parse_header(header)
+    )
+    module = {}
+    exec(compile(source, 'generated.py', 'exec'), module)
+
+    assert set(module['types'].keys()) == set(expected_types.keys())
+    for (key, value) in module['types'].items():
+        assert types_are_equivalent(value, expected_types[key])
+
+    assert set(module['symbols'].keys()) == set(expected_symbols.keys())
+    for (key, value) in module['symbols'].items():
+        assert types_are_equivalent(value, expected_symbols[key])
+
+    assert module['enum_consts'] == expected_enum_consts
+
+
+def test_generate_command(tmp_path):
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = tmp_path / 'libc_bindings.py'
+
+    def generate(path):
+        subprocess.run(
+            [
+                sys.executable, '-m', 'c_import', 'generate',
+                'libc.so.6', 'stdio.h', 'stdlib.h', 'time.h', 'wchar.h',
+                '-o', str(path),
+            ],
+            check=True,
+            cwd=repository,
+        )
+
+    # Unnamed records (in wchar.h) get the same names in every run
+    generate(output)
+    generate(tmp_path / 'again.py')
+    assert output.read_text() == (tmp_path / 'again.py').read_text()
+
+    # The bindings can't import clang
+    script = '''
+import sys
+sys.modules['clang'] = None
+import libc_bindings
+libc = libc_bindings.load()
+assert libc.abs(-3) == 3
+assert libc.div(34, 4).rem == 2
+assert libc.fileno(libc.stdout) == 1
+assert libc.tm.__name__ == 'tm'
+assert not hasattr(libc, 'missing')
+assert 'c_import' not in sys.modules
+'''
+    subprocess.run(
+        [sys.executable, '-c', script],
+        check=True,
+        cwd=tmp_path,
+    )
@@ -1213,3 +1213,53 @@ typedef uint8_t weird_short __attribute__((__vector_size__(2)));
             ('weird_short', 2),
     ):
         assert ctypes.sizeof(types[name]) == expected_byte_count
+
+
+def test_type_variants_are_memoized(tmpdir, monkeypatch):
+    header_content = '''
+struct s { int x; };
+typedef int (*callback)(struct s *, long);
+typedef struct s s_t;
+
+int foo(struct s *, long);
+int foo(s_t *, long);
+int foo(struct s *p, long l);
+callback g1;
+int (*g2)(s_t *, long);
+struct s *g3[4];
+s_t *g4[4];
+'''
+    header = tmpdir / 'header.h'
+    header.write(header_content)
+
+    created = []
+    original_cfunctype = ctypes.CFUNCTYPE
+    def counting_cfunctype(*args, **kwargs):
+        created.append(args)
+        return original_cfunctype(*args, **kwargs)
+    monkeypatch.setattr(ctypes, 'CFUNCTYPE', counting_cfunctype)
+
+    symbols = c_import.header_parser.parse_header(header).symbols
+    assert len(created) == 1
+    assert symbols['g1']._type_ is symbols['foo']
+    assert symbols['g1'] is symbols['g2']
+    assert symbols['g3'] is symbols['g4']
+
+
+def test_array_parameters_share_prototypes(tmpdir):
+    header_content = '''
+void h(int a[4]);
+void f(int *p);
+typedef void (*cb)(int *);
+'''
+    header = tmpdir / 'header.h'
+    header.write(header_content)
+
+    interface = c_import.header_parser.parse_header(header)
+    pointer = ctypes.POINTER(ctypes.c_int)
+    for prototype in (
+            interface.symbols['h'],
+            interface.symbols['f'],
+            interface.types['cb']._type_,
+    ):
+        assert prototype._argtypes_ == (pointer, )
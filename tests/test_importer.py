@@ -0,0 +1,78 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import importlib
+import json
+import os
+import subprocess
+import sys
+
+import c_import
+import pytest
+
+
+@pytest.fixture
+def registered_libc(tmp_path):
+    c_import.importer.register(
+        'test_libc',
+        'libc.so.6',
+        ['stdlib.h', 'stdio.h'],
+        cache_dir=tmp_path,
+    )
+    yield
+    c_import.importer.unregister('test_libc')
+
+
+def test_import_registered_library(registered_libc, tmp_path):
+    import c_import.libs.test_libc as libc
+    assert isinstance(libc, c_import.loader.CDLLX)
+    assert libc.abs(-7) == 7
+    assert libc.__name__ == 'c_import.libs.test_libc'
+    assert sys.modules['c_import.libs.test_libc'] is libc
+    assert importlib.import_module('c_import.libs.test_libc') is libc
+
+    # The interface was stored in the cache
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+def test_import_unregistered_library():
+    with pytest.raises(ModuleNotFoundError):
+        import c_import.libs.no_such_library
+
+
+def test_libs_file(tmp_path):
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    specs = tmp_path / 'libs.json'
+    specs.write_text(json.dumps({
+        'libc': {'library': 'libc.so.6', 'headers': ['stdlib.h']},
+    }))
+    environment = dict(
+        os.environ,
+        C_IMPORT_LIBS=str(specs),
+        C_IMPORT_CACHE_DIR=str(tmp_path / 'cache'),
+        PYTHONPATH=repository,
+    )
+    script = 'from c_import.libs import libc; assert libc.abs(-1) == 1'
+    for _ in range(2):
+        subprocess.run(
+            [sys.executable, '-c', script],
+            check=True,
+            env=environment,
+        )
+    assert len(list((tmp_path / 'cache').glob('*.json'))) == 1
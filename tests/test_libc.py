@@ -19,45 +19,46 @@
 
 import c_import
 import ctypes
+import gc
 import pytest
 import contextlib
+import tracemalloc
+
+LIBC_HEADERS = [
+    "assert.h",
+    # "complex.h", TODO: Not supported yet
+    "ctype.h",
+    "errno.h",
+    "fenv.h",
+    "float.h",
+    "inttypes.h",
+    "iso646.h",
+    "limits.h",
+    "locale.h",
+    "math.h",
+    "setjmp.h",
+    "signal.h",
+    "stdalign.h",
+    "stdarg.h",
+    # "stdatomic.h", TODO: Not supported yet
+    "stdbool.h",
+    "stddef.h",
+    "stdint.h",
+    "stdio.h",
+    "stdlib.h",
+    "stdnoreturn.h",
+    "string.h",
+    # "tgmath.h", TODO: Not supported yet
+    "threads.h",
+    "time.h",
+    "uchar.h",
+    "wchar.h",
+    "wctype.h",
+]
 
 @pytest.fixture(scope="session")
 def libc():
-    return c_import.loader.load(
-        "libc.so.6",
-        [
-            "assert.h",
-            # "complex.h", TODO: Not supported yet
-            "ctype.h",
-            "errno.h",
-            "fenv.h",
-            "float.h",
-            "inttypes.h",
-            "iso646.h",
-            "limits.h",
-            "locale.h",
-            "math.h",
-            "setjmp.h",
-            "signal.h",
-            "stdalign.h",
-            "stdarg.h",
-            # "stdatomic.h", TODO: Not supported yet
-            "stdbool.h",
-            "stddef.h",
-            "stdint.h",
-            "stdio.h",
-            "stdlib.h",
-            "stdnoreturn.h",
-            "string.h",
-            # "tgmath.h", TODO: Not supported yet
-            "threads.h",
-            "time.h",
-            "uchar.h",
-            "wchar.h",
-            "wctype.h",
-        ]
-    )
+    return c_import.loader.load("libc.so.6", LIBC_HEADERS)
 
 def test_stream_globals(libc):
     assert libc.stdin
@@ -137,3 +138,47 @@ def test_scanf(libc):
     assert b.value == b'e'
     assert c.value == -7
     assert abs(d.value - 3.4) < 0.01
+
+
+def test_specialized_variadic(libc):
+    assert {'printf', 'snprintf', 'sscanf'} <= libc._interface.variadic
+    assert 'puts' not in libc._interface.variadic
+
+    snprintf = libc.specialize('snprintf', ctypes.c_float, ctypes.c_char)
+    assert snprintf is libc.specialize('snprintf', ctypes.c_float, ctypes.c_char)
+    assert snprintf.argtypes[-2:] == (ctypes.c_double, ctypes.c_int)
+
+    buffer = ctypes.create_string_buffer(32)
+    assert snprintf(buffer, len(buffer), b"%.1f %c", 2.5, ord('x')) == 5
+    assert buffer.value == b"2.5 x"
+
+    with pytest.raises(ValueError):
+        libc.specialize('puts')
+
+def test_compact_footprint(tmp_path):
+    def retained_bytes(**kwargs):
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        library = c_import.loader.load("libc.so.6", LIBC_HEADERS, **kwargs)
+        gc.collect()
+        return (library, tracemalloc.get_traced_memory()[0] - before)
+
+    # Fill the cache
+    c_import.loader.load("libc.so.6", LIBC_HEADERS, cache_dir=tmp_path)
+
+    tracemalloc.start()
+    try:
+        (parsed, parsed_bytes) = retained_bytes()
+        (cached, cached_bytes) = retained_bytes(cache_dir=tmp_path)
+        (compact, compact_bytes) = retained_bytes(
+            cache_dir=tmp_path,
+            compact=True,
+        )
+    finally:
+        tracemalloc.stop()
+
+    assert cached_bytes < parsed_bytes
+    assert compact_bytes < parsed_bytes / 2
+    assert compact_bytes < 1024 * 1024
+    assert compact.abs(-3) == 3
+    assert compact.div(7, 2).rem == 1
@@ -0,0 +1,744 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import asyncio
+import concurrent.futures
+import ctypes
+import functools
+import multiprocessing
+import pickle
+import subprocess
+import sys
+import threading
+import time
+
+import clang.cindex
+import c_import
+import pytest
+
+
+def test_in_process_preprocessing(tmp_path):
+    header = tmp_path / 'header.h'
+    header.write_text('''
+#include <stdlib.h>
+#ifdef WITH_THING
+struct thing { int x; };
+#endif
+''')
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['header.h'],
+        cpp_flags=f'-I{tmp_path} -DWITH_THING',
+        use_cpp=False,
+    )
+    assert libc.abs(-3) == 3
+    assert libc.div(34, 4).quot == 8
+    assert libc.thing._fields_ == [('x', ctypes.c_int)]
+
+
+def test_builtin_include_flags(tmp_path, monkeypatch):
+    def install(*parts):
+        directory = tmp_path.joinpath(*parts, 'include')
+        directory.mkdir(parents=True)
+        (directory / 'stddef.h').touch()
+        return str(directory)
+
+    host_gcc = install('gcc', 'x86_64-linux-gnu', '12')
+    install('gcc', 'i686-linux-gnu', '13')
+    monkeypatch.setattr(c_import.loader, '_HOST_TARGET', 'x86_64-linux-gnu')
+    monkeypatch.setattr(
+        c_import.header_parser,
+        'clang_version',
+        lambda: 'clang version 18.1.1',
+    )
+    monkeypatch.setattr(clang.cindex.conf, 'get_filename', lambda: 'libclang.so')
+    monkeypatch.setattr(c_import.loader, '_BUILTIN_INCLUDE_PATTERNS', (
+        f'{tmp_path}/llvm-*/lib/clang/*/include',
+        f'{tmp_path}/gcc/*/*/include',
+    ))
+    find = c_import.loader.builtin_include_flags.__wrapped__
+
+    # Not the target with the highest numbers
+    assert find() == ('-isystem', host_gcc)
+
+    install('llvm-19', 'lib', 'clang', '19')
+    assert find() == ('-isystem', str(tmp_path / 'llvm-19/lib/clang/19/include'))
+
+    # The same version as libclang beats a newer one
+    matching = install('llvm-18', 'lib', 'clang', '18')
+    assert find() == ('-isystem', matching)
+
+
+def test_in_process_preprocessing_missing_header():
+    with pytest.raises(clang.cindex.TranslationUnitLoadError):
+        c_import.loader.load(
+            'libc.so.6',
+            ['no_such_header.h'],
+            use_cpp=False,
+        )
+
+
+def test_lazy_load():
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdio.h', 'stdlib.h', 'time.h', 'sys/stat.h'],
+        lazy=True,
+    )
+    assert libc._interface.symbols == {}
+    assert libc._interface.types == {}
+
+    assert libc.abs(-1) == 1
+    div_res = libc.div(34, 4)
+    assert (div_res.quot, div_res.rem) == (8, 2)
+    assert set(libc._interface.symbols) == {'abs', 'div'}
+
+    assert libc.fileno(libc.stdout) == 1
+    assert libc['tm'] is libc['tm']
+    assert 'tm_year' in dict(libc['tm']._fields_)
+
+    # Functions and struct tags live in different namespaces
+    assert isinstance(libc['stat'], ctypes._CFuncPtr)
+    assert issubclass(libc._interface.types['stat'], ctypes.Structure)
+
+    with pytest.raises(KeyError):
+        libc['no_such_symbol']
+
+
+def test_load_many():
+    (libc, libm) = c_import.loader.load_many(
+        [
+            ('libc.so.6', ['stdlib.h']),
+            {'library': 'libm.so.6', 'headers': ['math.h'], 'lazy': True},
+        ],
+        max_workers=2,
+    )
+    assert libc.abs(-5) == 5
+    assert libm.cos(0.0) == 1.0
+
+
+def test_load_many_error():
+    with pytest.raises(clang.cindex.TranslationUnitLoadError):
+        c_import.loader.load_many([
+            ('libc.so.6', ['stdlib.h']),
+            {'library': 'libc.so.6', 'headers': ['none.h'], 'use_cpp': False},
+        ])
+
+
+def test_sharded_load():
+    headers = ['stdio.h', 'stdlib.h', 'time.h', 'string.h', 'wchar.h']
+    sharded = c_import.loader.load('libc.so.6', headers, shards=3)
+    single = c_import.loader.load('libc.so.6', headers)
+
+    assert set(sharded._interface.symbols) == set(single._interface.symbols)
+    assert set(sharded._interface.types) == set(single._interface.types)
+    assert sharded._interface.enum_consts == single._interface.enum_consts
+
+    # Records included by several groups are merged
+    assert sharded['FILE'] is sharded.fopen.restype._type_
+    assert sharded['tm'] is sharded.mktime.argtypes[0]._type_
+    assert ctypes.sizeof(sharded['tm']) == ctypes.sizeof(single['tm'])
+
+    assert sharded.abs(-3) == 3
+    assert sharded.fileno(sharded.stdout) == 1
+
+
+def test_sharded_spawned_workers(monkeypatch):
+    # Spawned workers don't share the hash() seed of the parent
+    monkeypatch.setattr(
+        concurrent.futures,
+        'ProcessPoolExecutor',
+        functools.partial(
+            concurrent.futures.ProcessPoolExecutor,
+            mp_context=multiprocessing.get_context('spawn'),
+        ),
+    )
+    headers = ['stdlib.h', 'stdio.h', 'time.h', 'wchar.h']
+    (sharded, _) = c_import.loader.describe_headers_sharded(headers, 2)
+    (single, _) = c_import.loader.describe_headers_sharded(headers, 1)
+    assert len(sharded['records']) == len(single['records'])
+
+
+def test_symbol_allowlist():
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdio.h', 'stdlib.h', 'time.h'],
+        symbols=['abs', 'div', 'mktime', 'tm'],
+        prefixes=['str'],
+    )
+    interface = libc._interface
+    assert {'abs', 'div', 'mktime'} <= set(interface.symbols)
+    assert {'strtol', 'strtod', 'strftime'} <= set(interface.symbols)
+    assert not {'printf', 'fopen', 'malloc'} & set(interface.symbols)
+
+    # Referenced types come along, unrelated ones don't
+    assert 'div_t' in interface.types
+    assert 'tm' in interface.types
+    assert '_IO_FILE' not in interface.types
+
+    assert libc.abs(-2) == 2
+    assert libc.div(34, 4).rem == 2
+    assert libc.strtol(b'12', None, 10) == 12
+    with pytest.raises(KeyError):
+        libc['printf']
+
+
+def test_location_filter(tmp_path):
+    sdk = tmp_path / 'sdk'
+    (sdk / 'detail').mkdir(parents=True)
+    (sdk / 'detail' / 'impl.h').write_text('''
+#include <stdio.h>
+struct sdk_impl { FILE *log; };
+int sdk_impl_helper(void);
+''')
+    (sdk / 'sdk.h').write_text('''
+#include <detail/impl.h>
+struct sdk_handle { struct sdk_impl *impl; };
+int abs(int);
+''')
+
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['sdk.h'],
+        cpp_flags=f'-I{sdk}',
+        headers_only=True,
+    )
+    assert set(libc._interface.symbols) == {'abs'}
+    assert 'sdk_handle' in libc._interface.types
+    # Pulled in as a dependency only
+    assert 'sdk_impl' in libc._interface.types
+    assert 'sdk_impl_helper' not in libc._interface.symbols
+    assert 'fopen' not in libc._interface.symbols
+    assert libc.abs(-1) == 1
+
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['sdk.h'],
+        cpp_flags=f'-I{sdk}',
+        locations=[f'{sdk}/*'],
+    )
+    assert set(libc._interface.symbols) == {'abs', 'sdk_impl_helper'}
+
+
+@pytest.mark.parametrize('use_cpp', [True, False])
+def test_headers_only_same_name(use_cpp):
+    # bits/fcntl.h is not the fcntl.h that was asked for
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['fcntl.h'],
+        use_cpp=use_cpp,
+        headers_only=True,
+    )
+    assert 'fcntl' in libc._interface.symbols
+    assert 'flock' not in libc._interface.types
+
+
+def test_load_statistics():
+    reports = []
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdio.h', 'stdlib.h', 'time.h'],
+        statistics_hooks=[lambda lib, statistics: reports.append(
+            (lib, statistics)
+        )],
+    )
+    statistics = libc.load_statistics
+    assert reports == [(libc, statistics)]
+
+    assert ['preprocess', 'parse', 'walk'] == list(statistics.phases)
+    assert statistics.total_seconds == sum(statistics.phases.values())
+    assert statistics.preprocessed_bytes > 0
+
+    parse = statistics.parse
+    assert parse.declarations['FUNCTION_DECL'] > 0
+    assert parse.declarations['STRUCT_DECL'] > 0
+    assert parse.ctypes_classes > 0
+
+    slowest = parse.slowest_declarations()
+    assert 0 < len(slowest) <= parse.max_slowest
+    assert [x[0] for x in slowest] == sorted((x[0] for x in slowest), reverse=True)
+
+
+def test_lazy_load_statistics():
+    libc = c_import.loader.load('libc.so.6', ['stdlib.h'], lazy=True)
+    statistics = libc.load_statistics
+    assert list(statistics.phases) == ['preprocess', 'parse', 'index']
+    assert statistics.parse.ctypes_classes == 0
+
+    libc.div(34, 4)
+    assert statistics.parse.declarations['FUNCTION_DECL'] == 1
+    assert statistics.parse.ctypes_classes > 0
+
+
+def test_lookup_cache():
+    libc = c_import.loader.load('libc.so.6', ['stdio.h', 'stdlib.h'])
+    assert libc['abs'] is libc['abs']
+    assert libc.abs is libc['abs']
+    assert libc['stdout'] is libc['stdout']
+    assert libc['div_t'] is libc._interface.types['div_t']
+
+    assert not hasattr(libc, 'no_such_symbol')
+    assert 'no_such_symbol' in libc._missing
+    with pytest.raises(KeyError, match='no_such_symbol'):
+        libc['no_such_symbol']
+
+
+def test_dir():
+    libc = c_import.loader.load('libc.so.6', ['stdio.h', 'stdlib.h'], lazy=True)
+    names = dir(libc)
+    assert {'abs', 'printf', 'stdout', 'div_t', 'load_statistics'} <= set(names)
+    assert all(x.isidentifier() for x in names)
+    # Listing the names doesn't handle their declarations
+    assert libc._interface.symbols == {}
+
+
+def test_fast_call():
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdlib.h', 'ctype.h', 'stdio.h'],
+        fast_call=lambda name: name.startswith('is') or name == 'abs',
+    )
+    assert libc.abs._flags_ & ctypes._FUNCFLAG_PYTHONAPI
+    assert libc.isalpha._flags_ & ctypes._FUNCFLAG_PYTHONAPI
+    assert not libc.div._flags_ & ctypes._FUNCFLAG_PYTHONAPI
+    assert libc.abs(-2) == 2
+    assert libc.isalpha(ord('a'))
+    assert not libc.isalpha(ord('1'))
+    assert libc.div(34, 4).quot == 8
+
+    # The interface is shared, only the function objects differ
+    assert libc._interface.symbols['abs']._flags_ == ctypes._FUNCFLAG_CDECL
+
+    libc = c_import.loader.load('libc.so.6', ['stdio.h'], fast_call=['snprintf'])
+    snprintf = libc.specialize('snprintf', ctypes.c_int)
+    assert snprintf._flags_ & ctypes._FUNCFLAG_PYTHONAPI
+    buffer = ctypes.create_string_buffer(8)
+    assert snprintf(buffer, 8, b'%d', 42) == 2
+
+
+def test_load_async(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('blocking pre-processor')
+    monkeypatch.setattr(c_import.loader, 'preprocess_headers', fail)
+
+    async def main():
+        ticks = 0
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker = asyncio.create_task(tick())
+        libc = await c_import.loader.load_async('libc.so.6', ['stdlib.h'])
+        ticker.cancel()
+        return (libc, ticks)
+
+    (libc, ticks) = asyncio.run(main())
+    assert ticks > 1
+    assert libc.abs(-3) == 3
+    assert libc.load_statistics.preprocessed_bytes > 0
+
+
+def test_load_async_error():
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(c_import.loader.load_async('libc.so.6', ['none.h']))
+
+
+def test_background_load():
+    loaded = threading.Event()
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdio.h', 'stdlib.h'],
+        background=True,
+        statistics_hooks=[lambda *args: loaded.set()],
+    )
+    assert libc.abs(-4) == 4
+    assert libc.wait_loaded(0)
+    assert loaded.wait(10)
+    assert 'printf' in dir(libc)
+
+
+def test_background_load_error():
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['none.h'],
+        use_cpp=False,
+        background=True,
+    )
+    with pytest.raises(clang.cindex.TranslationUnitLoadError):
+        libc['abs']
+    with pytest.raises(clang.cindex.TranslationUnitLoadError):
+        libc.wait_loaded()
+
+
+def test_async_calls():
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdio.h', 'stdlib.h', 'string.h', 'unistd.h'],
+    )
+    threads = set()
+
+    async def main():
+        with concurrent.futures.ThreadPoolExecutor(
+                4,
+                thread_name_prefix='aio-test',
+                initializer=lambda: threads.add(threading.current_thread().name),
+        ) as pool:
+            aio = c_import.loader.AsyncLibrary(libc, pool)
+            start = time.perf_counter()
+            results = await asyncio.gather(*(aio.usleep(200000) for _ in range(4)))
+            elapsed = time.perf_counter() - start
+            length = await aio.strlen(ctypes.create_string_buffer(b'hello'))
+        return (results, elapsed, length)
+
+    (results, elapsed, length) = asyncio.run(main())
+    assert results == [0] * 4
+    assert elapsed < 0.6
+    assert length == 5
+    assert threads and all(x.startswith('aio-test') for x in threads)
+
+    assert libc.aio is libc.aio
+    assert libc.aio.strlen is libc.aio['strlen']
+    assert asyncio.run(libc.aio.abs(-7)) == 7
+    with pytest.raises(TypeError):
+        libc.aio.stdout
+    assert not hasattr(libc.aio, 'no_such_function')
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_reload(tmp_path, lazy):
+    header = tmp_path / 'point.h'
+    header.write_text('''
+typedef int coord_t;
+struct point { coord_t x, y; };
+struct size { int width, height; };
+enum shape { SQUARE, CIRCLE };
+''')
+    (tmp_path / 'lib.h').write_text('''
+#include <stdlib.h>
+#include "point.h"
+struct rect { struct point origin; struct size size; };
+struct node { struct point *point; struct node *next; };
+struct unrelated { div_t d; };
+int abs(int);
+''')
+    libc = c_import.loader.load(
+        'libc.so.6',
+        [tmp_path / 'lib.h'],
+        reloadable=True,
+        lazy=lazy,
+    )
+    (point, size, rect, node, unrelated, abs_) = (
+        libc['point'], libc['size'], libc['rect'], libc['node'],
+        libc['unrelated'], libc['abs'],
+    )
+    assert libc.reload() == set()
+
+    # Only touching a file changes nothing
+    header.write_text(header.read_text() + '\n// comment\n')
+    assert libc.reload() == set()
+    assert libc['point'] is point
+    assert libc['rect'] is rect
+    assert libc['node'] is node
+
+    header.write_text('''
+typedef long coord_t;
+struct point { coord_t x, y, z; };
+struct size { int width, height; };
+enum shape { SQUARE, CIRCLE = 3, TRIANGLE };
+int added;
+''')
+    names = libc.reload()
+    assert {'point', 'rect', 'node'} <= names
+    if not lazy:
+        # Lazy libraries only report the names that were looked up
+        assert {'coord_t', 'CIRCLE', 'TRIANGLE', 'added'} <= names
+    assert not {'size', 'unrelated', 'abs', 'div_t', 'SQUARE'} & names
+
+    assert libc['size'] is size
+    assert libc['unrelated'] is unrelated
+    assert libc['abs'] is abs_
+    assert libc.abs(-1) == 1
+    assert libc['point'] is not point
+    assert libc['point']._fields_[2] == ('z', ctypes.c_long)
+    assert libc['rect']._fields_[0][1] is libc['point']
+    assert libc['node']._fields_[0][1]._type_ is libc['point']
+    assert libc['CIRCLE'] == 3
+    assert libc['TRIANGLE'] == 4
+
+    header.write_text('struct point { int x; };')
+    libc.reload()
+    for name in ('coord_t', 'TRIANGLE', 'added'):
+        with pytest.raises(KeyError):
+            libc[name]
+    assert libc['point']._fields_ == [('x', ctypes.c_int)]
+
+
+def test_reload_ast_cache(tmp_path):
+    header = tmp_path / 'header.h'
+    header.write_text('struct p { int x; };')
+
+    def load():
+        return c_import.loader.load(
+            'libc.so.6',
+            [header],
+            reloadable=True,
+            ast_cache_dir=tmp_path / 'ast',
+        )
+
+    load()
+    # The translation unit now comes from the AST file
+    lib = load()
+    header.write_text('struct p { long y; };')
+    assert lib.reload() == {'p'}
+    assert lib['p']._fields_ == [('y', ctypes.c_long)]
+
+    header.write_text('struct p { short z; };')
+    assert lib.reload() == {'p'}
+    assert lib['p']._fields_ == [('z', ctypes.c_short)]
+
+
+def test_reload_without_translation_unit(tmp_path):
+    header = tmp_path / 'header.h'
+    header.write_text('struct s { int a; };')
+    lib = c_import.loader.load('libc.so.6', [header], use_cpp=False)
+    s = lib['s']
+    header.write_text('struct s { long b; };')
+    assert lib.reload() == {'s'}
+    assert lib['s'] is not s
+    assert lib['s']._fields_ == [('b', ctypes.c_long)]
+
+
+def test_type_registry(tmp_path):
+    registry = c_import.description.TypeRegistry()
+    first_header = tmp_path / 'first.h'
+    first_header.write_text('#include <time.h>\nstruct s { int a; };')
+    second_header = tmp_path / 'second.h'
+    second_header.write_text('#include <time.h>\nstruct s { long b; };')
+
+    def load(header, **kwargs):
+        return c_import.loader.load(
+            'libc.so.6',
+            [header],
+            type_registry=registry,
+            **kwargs,
+        )
+
+    first = load(first_header)
+    second = load(second_header, cache_dir=tmp_path / 'cache')
+    assert first['tm'] is second['tm']
+    assert len(registry) > 0
+    assert first['s'] is not second['s']
+    assert second['s']._fields_ == [('b', ctypes.c_long)]
+
+    # A record of one library can be passed to the functions of the other
+    tm = first.tm(tm_year=100, tm_mday=1)
+    assert second.mktime(ctypes.pointer(tm)) != -1
+    assert tm.tm_yday == 0
+
+    # Cache hits are interned too
+    assert load(second_header, cache_dir=tmp_path / 'cache')['s'] \
+        is second['s']
+
+    unshared = c_import.loader.load('libc.so.6', [first_header])
+    assert unshared['tm'] is not first['tm']
+    with pytest.raises(ctypes.ArgumentError):
+        first.mktime(ctypes.pointer(unshared.tm()))
+
+
+def test_type_registry_across_processes(tmp_path):
+    # hash() differs in the process that fills the cache
+    subprocess.run(
+        [
+            sys.executable, '-c',
+            'import sys, c_import.loader\n'
+            'c_import.loader.load(\n'
+            '    "libc.so.6", ["wchar.h"], cache_dir=sys.argv[1]\n'
+            ')',
+            str(tmp_path),
+        ],
+        check=True,
+    )
+
+    registry = c_import.description.TypeRegistry()
+    cached = c_import.loader.load(
+        'libc.so.6',
+        ['wchar.h'],
+        cache_dir=tmp_path,
+        type_registry=registry,
+    )
+    parsed = c_import.loader.load(
+        'libc.so.6',
+        ['wchar.h', 'stdlib.h'],
+        type_registry=registry,
+    )
+    # Holds an unnamed union
+    assert cached['mbstate_t'] is parsed['mbstate_t']
+
+
+def test_memory_report(tmp_path):
+    c_import.loader.load('libc.so.6', ['stdlib.h'], cache_dir=tmp_path)
+    libc = c_import.loader.load(
+        'libc.so.6',
+        ['stdlib.h'],
+        cache_dir=tmp_path,
+        compact=True,
+    )
+    assert isinstance(libc._interface.types,
+                      c_import.description.DescribedTable)
+
+    report = libc.memory_report()
+    assert report['records'] == report['functions'] == 0
+    assert report['descriptions'] > 0
+
+    assert libc.div(7, 2).quot == 3
+    after_lookup = libc.memory_report()
+    assert after_lookup['records'] > 0
+    assert after_lookup['functions'] > 0
+    assert after_lookup['lookups'] > report['lookups']
+    assert after_lookup['descriptions'] < report['descriptions']
+
+    parsed = c_import.loader.load('libc.so.6', ['stdlib.h'])
+    assert parsed.memory_report()['descriptions'] < report['descriptions']
+    assert parsed.memory_report()['records'] > after_lookup['records']
+
+
+def _quotient(value):
+    return value.quot
+
+
+def _call_abs(lib, value):
+    return (lib.abs(value), sorted(lib.load_statistics.phases))
+
+
+def _sleep(lib, duration):
+    return lib.nanosleep(ctypes.pointer(duration), None)
+
+
+def test_pickle(tmp_path):
+    header = tmp_path / 'header.h'
+    header.write_text('''
+#include <stdlib.h>
+#include <time.h>
+struct node {
+    struct node *next;
+    union { int i; float f; };
+    int (*compare)(const struct node *, const struct node *);
+};
+''')
+    libc = c_import.loader.load('libc.so.6', [header])
+
+    # Classes round trip to themselves in the same process
+    for ctype in (
+            libc['node'],
+            libc['div_t'],
+            ctypes.POINTER(libc['node']),
+            libc['node']._fields_[2][1],
+            libc['node'] * 2,
+    ):
+        assert pickle.loads(pickle.dumps(ctype)) is ctype
+    quotient = pickle.loads(pickle.dumps(libc.div(7, 2)))
+    assert type(quotient) is libc['div_t']
+    assert (quotient.quot, quotient.rem) == (3, 1)
+    assert pickle.loads(pickle.dumps(libc)) is pickle.loads(pickle.dumps(libc))
+
+    # Other ctypes classes keep pickle's default behaviour
+    class Local(ctypes.Structure):
+        _fields_ = [('a', ctypes.c_int)]
+    with pytest.raises((pickle.PicklingError, AttributeError)):
+        pickle.dumps(Local)
+    with pytest.raises(pickle.PicklingError):
+        pickle.dumps(ctypes.POINTER(ctypes.c_int))
+
+    with pytest.raises(pickle.PicklingError, match='fast_call'):
+        pickle.dumps(c_import.loader.load(
+            'libc.so.6',
+            ['stdlib.h'],
+            fast_call=lambda name: True,
+        ))
+
+    cached = c_import.loader.load(
+        'libc.so.6',
+        [header],
+        cache_dir=tmp_path / 'cache',
+    )
+    with concurrent.futures.ProcessPoolExecutor(
+            2,
+            mp_context=multiprocessing.get_context('spawn'),
+    ) as pool:
+        assert pool.submit(_quotient, libc.div(9, 2)).result() == 4
+        for lib in (libc, cached):
+            (result, phases) = pool.submit(_call_abs, lib, -3).result()
+            assert result == 3
+            assert 'parse' not in phases
+            # Records sent along are the classes of the worker's library
+            assert pool.submit(_sleep, lib, lib.timespec(0, 1000)).result() == 0
+
+
+def _advance_years(libc, handle):
+    with handle.attach() as shared:
+        for tm in shared.value:
+            tm.tm_year += 1
+            # Attached records are of the classes of the library
+            assert libc.mktime(ctypes.pointer(tm)) != -1
+        return sum(tm.tm_yday for tm in shared.value)
+
+
+def test_new_shared():
+    libc = c_import.loader.load('libc.so.6', ['time.h'])
+    shared = libc.new_shared('tm', count=4)
+    try:
+        assert type(shared.value) is libc['tm'] * 4
+        for (i, tm) in enumerate(shared.value):
+            tm.tm_year = 100 + i
+            tm.tm_mday = 10
+
+        with concurrent.futures.ProcessPoolExecutor(
+                1,
+                mp_context=multiprocessing.get_context('spawn'),
+        ) as pool:
+            assert pool.submit(
+                _advance_years,
+                libc,
+                shared.handle,
+            ).result() == 4 * 9
+        assert [tm.tm_year for tm in shared.value] == [101, 102, 103, 104]
+        assert [tm.tm_yday for tm in shared.value] == [9] * 4
+
+        attached = pickle.loads(pickle.dumps(shared.handle)).attach()
+        assert type(attached.value) is type(shared.value)
+        attached.value[0].tm_mon = 5
+        assert shared.value[0].tm_mon == 5
+        attached.close()
+    finally:
+        shared.close()
+        shared.unlink()
+
+    single = libc.new_shared('tm')
+    assert type(single.value) is libc['tm']
+    single.close()
+    single.unlink()
+
+    with pytest.raises(TypeError):
+        libc.new_shared('mktime')
+
+
+def test_wait_symbol():
+    libc = c_import.loader.load('libc.so.6', ['sys/wait.h'])
+    assert isinstance(libc.wait, ctypes._CFuncPtr)
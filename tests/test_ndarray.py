@@ -0,0 +1,104 @@
+# Copyright (C) 2023  Lior Stern
+#
+# This file is part of c_import.
+#
+# c_import is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# c_import is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with c_import.  If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import ctypes
+
+import c_import
+import pytest
+
+numpy = pytest.importorskip('numpy')
+import c_import.ndarray
+
+
+HEADER = '''
+struct __attribute__((packed)) sample {
+    char tag;
+    double value;
+    union {
+        int i;
+        float f;
+    };
+    struct {
+        short x, y;
+    };
+    int history[2][3];
+    unsigned int flag : 1;
+    struct sample *next;
+    void (*callback)(void);
+};
+union number { long l; double d; };
+'''
+
+
+@pytest.fixture
+def lib(tmp_path):
+    header = tmp_path / 'header.h'
+    header.write_text(HEADER)
+    return c_import.loader.load('libc.so.6', [header])
+
+
+def test_dtype(lib):
+    sample = lib['sample']
+    dtype = c_import.ndarray.dtype(sample)
+    assert dtype.itemsize == ctypes.sizeof(sample)
+    assert dtype.names == (
+        'tag', 'value', 'i', 'f', 'x', 'y', 'history', 'next', 'callback',
+    )
+    for name in dtype.names:
+        assert dtype.fields[name][1] == getattr(sample, name).offset
+    assert dtype.fields['value'][1] == 1
+    assert dtype['history'].shape == (2, 3)
+    assert dtype['next'] == numpy.uintp
+
+    number = c_import.ndarray.dtype(lib['number'])
+    assert number.fields['l'][1] == number.fields['d'][1] == 0
+    assert number.itemsize == 8
+
+
+def test_views(lib):
+    samples = (lib['sample'] * 3)()
+    samples[1].value = 2.5
+    samples[2].x = 7
+    samples[2].history[1][2] = 9
+
+    view = c_import.ndarray.from_pointer(
+        ctypes.cast(samples, ctypes.POINTER(lib['sample'])),
+        len(samples),
+    )
+    assert view['value'].tolist() == [0, 2.5, 0]
+    assert view['x'][2] == 7
+    assert view['history'][2, 1, 2] == 9
+
+    # Views share memory with the C objects
+    view['i'] = [1, 2, 3]
+    assert samples[2].i == 3
+    record = c_import.ndarray.view(samples[1])
+    assert record.shape == ()
+    record['y'] = 5
+    assert samples[1].y == 5
+
+    with pytest.raises(ValueError):
+        c_import.ndarray.from_pointer(ctypes.POINTER(lib['sample'])(), 1)
+
+
+def test_global_array():
+    libc = c_import.loader.load('libc.so.6', ['time.h'])
+    tzname = c_import.ndarray.view(libc.tzname)
+    assert tzname.shape == (2, )
+    assert tzname[0] == ctypes.cast(libc.tzname[0], ctypes.c_void_p).value